@@ -3,118 +3,410 @@
 Acoustics node
 ==============
 Communciation between TX1 and the beaglebone soundcard. Once data is on-board
-the TX1, detect pings with a threshold, then determine arrival time and angle.
+the TX1, detect pings with a CFAR detector or a fixed threshold, then
+determine arrival time and angle. When the beagle only sends windows around
+pings, the samples between them are treated as missing data, and the noise
+floor is taken from its keepalive summaries.
 
-Requires a compiled version of audio_data_t. This is done at the command line.
-First, navigate to the aoustics/ folder
-lcm-gen -p audio_data_t.lcm
+Requires a compiled version of audio_data_v2_t. This is done at the command
+line. First, navigate to the aoustics/ folder
+lcm-gen -p audio_data_v2_t.lcm
 """
 import numpy as np
-from math import pi
+from math import floor, ceil
 import threading
 import select
+import queue
 
 import lcm
 from zoidberg import empty_value
-from zoidberg_lcm import audio_data_t
+from zoidberg_lcm import audio_data_v2_t, audio_status_t
+from ring_buffer import RingBuffer
+from beamformer import Beamformer
+from array_geometry import ArrayGeometry
+from cfar import CfarDetector
+from ping_tracker import PingTracker
+from ping_history import PingHistory
+import audio_payload
 
 fs = 96000  # sampling frequency
 num_channels = 3
 
 class AcousticsNode:
     """Download sound information from beaglebone, beamform at each ping"""
-    def __init__(self, fc):
-        """This node requires an external source of acoustic data"""
+    def __init__(self, fc, beam_method='bartlett', geometry=None):
+        """This node requires an external source of acoustic data
+        fc is the frequency of interest, or None to follow the frequency sent
+        by the beagle, for example after a band search. The first frequency
+        seen is kept until it has not been sent for follow_timeout
+        beam_method is the bearing estimator, bartlett, mvdr or music
+        geometry is the ArrayGeometry of the hydrophones, by default a line
+        array of num_channels elements. Messages must have one channel for
+        each element.
+        """
         # center frequency that we are looking for
         self.fc = fc
+        self.follow_fc = fc is None
+        # followed frequency is kept until it is not sent for this long, (s)
+        self.follow_timeout = 1.
 
         # This information is designed to be used by zoidberg mission
         self.arrival_time = empty_value
         self.bearing = empty_value
+        self.elevation = empty_value  # only resolved by non-linear arrays
+        self.power = empty_value  # beam power at bearing
+        self.beam_width = empty_value  # -3 dB beam width, (rad)
 
         # This information is downloaded from beagle bone
         # sampling frequency
         self.fs = fs
-        # time at which data was received
-        self.timestamp = None
+        # epoch time of first sample in latest data, (us)
+        self.utime = None
+        # number of samples sent before latest data
+        self.sample_index = None
         # latest data
         self.recorded_data = None
         # numer of raw samples in each reading
         self.num_step = None
+        # mean power of each channel between pings, from beagle summaries
+        self.noise_floor = None
+        # epoch time of latest summary, (us), and number of beagle triggers
+        self.status_utime = None
+        self.num_triggers = 0
+
+        # continuous record of the last few seconds of data
+        self.buffer_time = 2.  # length of saved data, (s)
+        self.ring = None
+        self._ring_step = None
+        # absolute sample index and time of the latest message start
+        self._msg_index = 0
+        self._msg_time = None
+        # difference between beagle sample index and ring buffer index
+        self._index_offset = 0
+        # absolute sample index where the next search starts
+        self._search_i = 0
+        # absolute sample index of last confirmed arrival
+        self._arrival_i = None
+        # detection decision of each sample in the ring buffer
+        self._is_over = None
+        # absolute sample index of the next sample expected by the detector
+        self._cfar_i = 0
+        # absolute sample index of the first sample after missing data
+        self._data_i = 0
+        # amplitude that is loud outside of the gate, set from the noisiest
+        # channel at the start of the last gate
+        self._monitor_level = None
+        # samples searched outside of the gate after a loud message
+        self._monitor_i = (0, 0)
 
         # ping detection information
         self.dx = 0.0185  # spacing of hydrophones, (m)
+        if geometry is None:
+            geometry = ArrayGeometry.line_array(num_channels, self.dx)
+        self.geometry = geometry
         self.c = 1480  # speed of sound, fresh water
-        self.threshold = 1  # detection threshold
+        # detection is cfar, adaptive to the noise of each channel, or
+        # threshold, a fixed level of the first channel
+        self.detection = 'cfar'
+        self.detector = CfarDetector(geometry.num_channels)
+        # fixed detection threshold of the baseband amplitude. Sound card
+        # full scale is 1, and a full scale tone at fc is about 40 after the
+        # beagle DFT, so this is a tone 32 dB below full scale
+        self.threshold = 1.
         self.dead_time = 0.2  # minimum time between detections, (s)
+        # once the pinger period is locked, only search a gate around the
+        # next expected ping, and fall back to full search when lost
+        self.gating = True
+        self.tracker = PingTracker()
+        self.num_gated = 0  # number of messages searched only in a gate
+        # outside of the gate, a message this far above the gate noise is
+        # searched. An arrival there is not published, it is held by the
+        # tracker as a candidate, (dB)
+        self.monitor_snr = 20.
+        self.num_monitored = 0  # number of loud messages outside the gate
         self.num_snapshots = 4  # number of snapshots used in beamforming, > 1
-        num_look = 300  # oversample in possible look directions
-        # look directions are from -pi / 2 to pi / 2
-        self.look_directions = np.arange(num_look) * pi / num_look - pi / 2
-        k_x = (2 * pi * self.fc / self.c) * np.sin(self.look_directions)
-        self.look_vectors = np.exp(1j * np.arange(num_channels)[:, None]
-                                   * self.dx * k_x)
+        # look directions are from -pi / 2 to pi / 2, coarse to fine search
+        self.beam_method = beam_method
+        self.beamformer = None
+        if fc is not None:
+            self.set_fc(fc)
 
         # local variables for communication over lcm
         self.lc = None
         self.stop_threads = False
 
+        # hand off between lcm listener and processing threads
+        self.queue_size = 16  # maximum number of waiting messages
+        self.drop_oldest = True  # when full, drop oldest or newest message
+        self.msg_queue = None
+        # message counters
+        self.num_received = 0
+        self.num_processed = 0
+        self.num_dropped = 0
+        self.num_errors = 0  # messages that could not be processed
+
+        # every detected ping is saved, and consumers are notified
+        self.history = PingHistory()
+        self.ping_condition = threading.Condition()
+        self._subscribers = []
+
+    def set_fc(self, fc):
+        """Change the frequency of interest, saved data is cleared. A new
+        geometry is also used from here on.
+        """
+        self.fc = fc
+        if self.detector.num_channels != self.geometry.num_channels:
+            self.detector = CfarDetector(self.geometry.num_channels,
+                                         pfa=self.detector.pfa,
+                                         num_ref=self.detector.num_ref,
+                                         num_guard=self.detector.num_guard)
+        self.beamformer = Beamformer(self.geometry,
+                                     self.fc,
+                                     self.c,
+                                     method=self.beam_method)
+        self.ring = None
+
     def is_active(self, to_arm):
         """Startup and shut down communication with beagle over lcm"""
         if to_arm:
             # startup LCM communication
             self.lc = lcm.LCM()
+            self.msg_queue = queue.Queue(maxsize=self.queue_size)
             # subscribe LCM listener
             self.lc.subscribe("ACOUSTICS", self._get_handler())
+            # summaries are small and rare, handled by the listener
+            self.lc.subscribe("ACOUSTICS_STATUS",
+                              lambda channel, data: self.handle_status(data))
             # Run listen loop in its own thread.
             t1 = threading.Thread(target=self._get_listener())
+            # Run processing loop in its own thread.
+            t2 = threading.Thread(target=self._get_worker())
             # flag used to indicate that the thread should stop.
             self.stop_threads = False
             t1.start()
+            t2.start()
         else:
             self.stop_threads = True
 
     def process_data(self):
         """Detect pings, and beamform if present
+        Search is done over all samples that have not been searched yet, so
+        pings are found across message boundaries.
         """
-        # Threshold step, performed on first axis
-        max_i = np.argmax(np.abs(self.recorded_data[0, :]))
-        max_val = np.abs(self.recorded_data[0, max_i])
+        start = self._search_start()
+        num_new = self.ring.count - start
+        if num_new <= 0:
+            return
+
+        is_over = self._is_over.get(start, num_new)[0]
 
         # if we don't meet threshold requirement, return without do anything
-        if max_val < self.threshold:
+        if not np.any(is_over):
+            self._search_i = self.ring.count
             return
 
-        # estimate when the pressure exceeded the threshold
-        is_over = np.abs(self.recorded_data[0, : max_i + 1]) > self.threshold
-        fei = np.argmax(is_over)
-        # compute arrival time in ms from midnight
-        arrival_time = self.timestamp.split('_')
-        arrival_time = float(arrival_time[-4]) * 3600 \
-                     + float(arrival_time[-3]) * 60 \
-                     + float(arrival_time[-2]) \
-                     + float(arrival_time[-1]) / 1000
-        arrival_time += fei * self.num_step / self.fs
-
-        # check if we have sufficent dead time from last detection
-        if self.arrival_time is not None \
-            and arrival_time - self.arrival_time < self.dead_time:
+        # first sample where the pressure exceeded the threshold
+        fei = start + np.argmax(is_over)
+
+        # wait for the next message if all snapshots are not yet available
+        if (fei + self.num_snapshots) > self.ring.count:
+            self._search_i = fei
             return
 
-        # very sloppy check for edge case. just drop it if it comes up
-        if (fei + self.num_snapshots) >= self.recorded_data.shape[1]:
+        if self._monitor_i[0] <= fei < self._monitor_i[1]:
+            # arrival outside of the gate, held until another one agrees
+            self._search_i = self._monitor_i[1]
+            self.tracker.add_candidate(self._index_to_time(fei))
             return
 
         # confirmed arrival, compute and log result
-        self.arrival_time = arrival_time
+        self._arrival_i = fei
+        self._search_i = fei + 1
+        self.arrival_time = self._index_to_time(fei)
+        self.tracker.add(self.arrival_time)
 
         # beamform arrivals
-        beams = self.recorded_data[:, fei: fei + self.num_snapshots]
-        K = np.conj(beams) @ beams.T / self.num_snapshots
-        B = (np.conj(self.look_vectors).T @ K) * self.look_vectors.T
-        B = B.sum(axis=1)
-        max_beam = np.argmax(B)
-        self.bearing = self.look_directions[max_beam]
+        beams = self.ring.get(fei, self.num_snapshots)
+        K = self.beamformer.cross_spectral(beams)
+        self.bearing, self.elevation, self.power, self.beam_width = \
+                self.beamformer.beamform(K)
+        self._notify()
+
+    def _notify(self):
+        """Save latest ping, wake up waiting threads and call subscribers"""
+        with self.ping_condition:
+            ping = self.history.add(self.arrival_time, self.bearing,
+                                    self.elevation, self.power)
+            self.ping_condition.notify_all()
+        for callback in list(self._subscribers):
+            callback(ping)
+
+    def wait_for_ping(self, timeout=None, after=None):
+        """Block until a ping is detected, or timeout seconds have passed
+        after is the sequence index of the last ping seen by the caller. All
+        saved pings since then are returned, so none are missed between calls.
+        By default only pings detected after this call are returned.
+        returns a structured array of pings, see ping_history, which is
+        empty on timeout
+        """
+        with self.ping_condition:
+            start = self.history.count if after is None else after + 1
+            self.ping_condition.wait_for(lambda: self.history.count > start,
+                                         timeout=timeout)
+            return self.history.since(start).copy()
+
+    def subscribe(self, callback):
+        """Call callback(ping) for every detected ping. It is called from the
+        processing thread, so it should return quickly.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Stop calling callback"""
+        self._subscribers.remove(callback)
+
+    def _add_data(self):
+        """Save latest message data in ring buffer, returns False when it
+        was not searched for pings
+        """
+        # (re)start the buffer when the sample rate changes
+        if self.ring is None or self._ring_step != self.num_step:
+            capacity = int(self.buffer_time * self.fs / self.num_step)
+            self.ring = RingBuffer(self.geometry.num_channels, capacity)
+            self._is_over = RingBuffer(1, capacity, dtype=bool)
+            self._ring_step = self.num_step
+            self._restart_index()
+
+        gap = self.sample_index - (self.ring.count + self._index_offset)
+        if gap > 0:
+            # messages were lost, keep sample indices aligned
+            self.ring.skip(gap)
+            self._data_i = self.ring.count
+        elif gap < 0:
+            # beagle has restarted
+            self._restart_index()
+
+        self._msg_index = self.ring.count
+        self._msg_time = self.utime / 1e6
+        self.ring.append(self.recorded_data)
+        is_over = self._gated_detect()
+        if is_over is None:
+            return False
+        # catch up over messages that were not searched
+        self._is_over.skip(self._msg_index - self._is_over.count)
+        self._is_over.append(is_over[None, :])
+        return True
+
+    def _gated_detect(self):
+        """Detection decision of each sample of the latest message. Once the
+        pinger is tracked, only samples inside the gate are searched. A
+        message outside of the gate only has its peak power checked, and
+        returns None when it is quiet.
+        """
+        end = self.ring.count
+        start = self._msg_index
+        is_locked = self.tracker.update(self._msg_time)
+        if not (self.gating and is_locked):
+            return self._detect(start, end)
+
+        self.num_gated += 1
+        gate_start, gate_end = self.tracker.gate()
+        gate_start = max(floor(self._time_to_index(gate_start)), start)
+        gate_end = min(ceil(self._time_to_index(gate_end)), end)
+        if gate_end <= gate_start and self._search_start() >= start:
+            if not self._is_loud():
+                self._search_i = end
+                return None
+            # energy outside of the gate, search the whole message
+            self.num_monitored += 1
+            self._monitor_i = (start, end)
+            return self._detect(start, end)
+
+        is_over = np.zeros(end - start, dtype=bool)
+        if gate_end > gate_start:
+            is_over[gate_start - start: gate_end - start] = \
+                    self._detect(gate_start, gate_end)
+        return is_over
+
+    def _search_start(self):
+        """Absolute sample index where the next search starts, after the
+        dead time of the last detection
+        """
+        start = max(self._search_i, self.ring.first)
+        if self._arrival_i is not None:
+            num_dead = ceil(self.dead_time * self.fs / self.num_step)
+            start = max(start, self._arrival_i + num_dead)
+        return start
+
+    def _detect(self, start, end):
+        """Detection decision of ring buffer samples from start to end"""
+        samples = self.ring.get(start, end - start)
+        if self.detection == 'threshold':
+            return np.abs(samples[0]) > self.threshold
+        elif self.detection != 'cfar':
+            raise ValueError('Unknown detection {}'.format(self.detection))
+        if start != self._cfar_i:
+            # samples were skipped, noise reference comes from ring buffer
+            self.detector.reset()
+            ref_start = max(start - self.detector.num_ref
+                            - self.detector.num_guard, self.ring.first,
+                            self._data_i)
+            self.detector.update(self.ring.get(ref_start, start - ref_start))
+            self._set_monitor_level(start)
+        self._cfar_i = end
+        return self.detector.detect(samples)
+
+    def _is_loud(self):
+        """Check of the latest message outside of the gate, True when its
+        peak power is well above the noise at the start of the last gate
+        """
+        samples = self.recorded_data
+        if self.detection == 'threshold':
+            return np.abs(samples[0]).max() > self.threshold
+        if self._monitor_level is None:
+            # no gate has been searched since the lock
+            self._set_monitor_level(self._msg_index)
+            if self._monitor_level is None:
+                return False
+        return np.abs(samples).max() > self._monitor_level
+
+    def _set_monitor_level(self, end):
+        """Loud amplitude outside of the gate, from the noise reference
+        samples before absolute sample index end. The reference may hold the
+        last ping, so noise power is estimated from the median.
+        """
+        ref_start = max(end - self.detector.num_ref, self.ring.first,
+                        self._data_i)
+        self._monitor_level = None
+        if end > ref_start:
+            samples = self.ring.get(ref_start, end - ref_start)
+            power = samples.real ** 2 + samples.imag ** 2
+            # median of exponential power is ln 2 times the mean
+            noise = np.max(np.median(power, axis=1)) / np.log(2)
+            snr = 10 ** (self.monitor_snr / 10)
+            self._monitor_level = float(np.sqrt(noise * snr))
+
+    def _restart_index(self):
+        """Align ring buffer index with beagle sample index"""
+        self._index_offset = self.sample_index - self.ring.count
+        self._search_i = self.ring.count
+        self._arrival_i = None
+        self._cfar_i = self.ring.count
+        self._data_i = self.ring.count
+        self._monitor_level = None
+        self._monitor_i = (0, 0)
+        self.detector.reset()
+        self.tracker.reset()
+
+    def _index_to_time(self, sample_i):
+        """Epoch time of absolute sample index, (s)"""
+        return self._msg_time \
+               + (sample_i - self._msg_index) * self.num_step / self.fs
+
+    def _time_to_index(self, epoch_time):
+        """Absolute sample index of epoch time, (s), not rounded"""
+        return self._msg_index \
+               + (epoch_time - self._msg_time) * self.fs / self.num_step
 
     def _get_listener(self):
         """return a function that starts an infinite loop in a seperate thread
@@ -134,18 +426,81 @@ class AcousticsNode:
                     self.lc.handle()
         return main_loop
 
+    def _get_worker(self):
+        """return a function that processes queued messages in a seperate
+        thread, so that slow processing does not block the lcm listener
+        """
+        tout = 0.1  # a timeout to force to check if thread has stopped
+        def worker_loop():
+            """Function to allow self to be used between threads"""
+            while not self.stop_threads:
+                try:
+                    data = self.msg_queue.get(timeout=tout)
+                except queue.Empty:
+                    continue
+                try:
+                    self.handle_message(data)
+                except Exception as e:
+                    # a bad message is dropped, the worker keeps running
+                    self.num_errors += 1
+                    print('Acoustics message not processed: {!r}'.format(e))
+                    continue
+                self.num_processed += 1
+        return worker_loop
+
     def _get_handler(self):
-        """return a handler that records the latest message"""
+        """return a handler that queues the latest message"""
         def lcm_handler(channel, data):
             """Function to allow self to be used between threads"""
-            msg = audio_data_t.decode(data)
-            self.timestamp = msg.timestamp
-            self.num_step = msg.num_step
-            self.fs = msg.fs
-            # construct complex array from real and imaginary components
-            self.recorded_data = np.array(msg.re_samples) \
-                               + 1j * np.array(msg.im_samples)
-            #self.recorded_data = np.transpose(self.recorded_data)
-            # process new data
-            self.process_data()
+            self.num_received += 1
+            try:
+                self.msg_queue.put_nowait(data)
+                return
+            except queue.Full:
+                self.num_dropped += 1
+            if not self.drop_oldest:
+                return
+            # make room for the latest message
+            try:
+                self.msg_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.msg_queue.put_nowait(data)
+            except queue.Full:
+                pass
         return lcm_handler
+
+    def handle_message(self, data):
+        """Decode an encoded audio_data_v2_t message and process it"""
+        msg = audio_data_v2_t.decode(data)
+        # beagle may publish a filter bank, only keep our frequency
+        if msg.fc != self.fc:
+            if not self.follow_fc:
+                return
+            # only follow a retuned beagle, other bins of a bank are ignored
+            if self.utime is not None and \
+                    msg.utime - self.utime < self.follow_timeout * 1e6:
+                return
+            self.set_fc(msg.fc)
+        self.utime = msg.utime
+        self.sample_index = msg.sample_index
+        self.num_step = msg.num_step
+        self.fs = msg.fs
+        if msg.num_channels != self.geometry.num_channels:
+            raise ValueError('Message has {} channels, array has {}'.format(
+                             msg.num_channels, self.geometry.num_channels))
+        # complex array is a view of the message payload
+        self.recorded_data = audio_payload.decode_samples(msg)
+        # process new data, quiet messages outside of the gate are only saved
+        if self._add_data():
+            self.process_data()
+
+    def handle_status(self, data):
+        """Decode an encoded audio_status_t noise summary"""
+        msg = audio_status_t.decode(data)
+        if msg.fc != self.fc:
+            return
+        self.status_utime = msg.utime
+        self.noise_floor = np.array(msg.noise_floor)
+        self.num_triggers = msg.num_triggers
@@ -1,5 +1,4 @@
 import numpy as np
-from time import sleep
 import matplotlib.pyplot as plt
 
 from acoustics_node import AcousticsNode
@@ -9,26 +8,20 @@ plt.ion()
 fc = 30000
 an = AcousticsNode(fc)
 
-bout = []
-tout = []
-arrival_time = None
+pings = []
+last_index = None
 try:
     an.is_active(True)
     while True:
-        if (arrival_time is None and an.arrival_time > 0)\
-                or an.arrival_time != arrival_time:
-            arrival_time = an.arrival_time
-            bout.append(an.bearing)
-            tout.append(an.arrival_time)
-        sleep(0.001)
+        # sleeps until the next ping, no pings are missed between calls
+        new_pings = an.wait_for_ping(timeout=1., after=last_index)
+        if new_pings.size:
+            last_index = new_pings['index'][-1]
+            pings.append(new_pings)
 finally:
     an.is_active(False)
-    # recorded data
-    bout = np.array(bout)
-    tout = np.array(tout)
-    # remove invalid results
-    bout = bout[bout > -1000]
-    tout = tout[tout > -1000]
 
+# recorded data
+pings = np.concatenate(pings) if pings else an.history.saved()
 fig, ax = plt.subplots()
-ax.plot(tout, bout, '.')
+ax.plot(pings['arrival_time'], pings['bearing'], '.')
@@ -0,0 +1,123 @@
+"""
+==============
+Array geometry
+==============
+Hydrophone element positions, and steering vectors for a grid of azimuth and
+elevation look directions. Azimuth is measured from the y axis towards the x
+axis, elevation is measured up from the x-y plane. A line array along the x
+axis only resolves azimuth, from -pi / 2 to pi / 2. A planar array in the x-y
+plane can not tell up from down, a source at elevation el is also found at
+-el.
+
+A look direction u points from the array towards the source. A plane wave
+from u reaches the element at position p earlier by p . u / c, so at baseband,
+after the exp(-j 2 pi fc t) of the beagle DFT, its phase is exp(j k p . u).
+This is the steering vector.
+
+Steering tables are cached for each combination of geometry, center frequency,
+speed of sound and look direction grid, since they are the same for every ping.
+Only the most recently used tables are kept, so a node that follows a changing
+frequency does not grow the cache without limit.
+"""
+import numpy as np
+from math import pi
+from collections import OrderedDict
+
+
+class ArrayGeometry:
+    """3-D positions of each hydrophone"""
+    def __init__(self, positions):
+        """positions has shape (num_channels, 3), (m)"""
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        self.positions.flags.writeable = False
+        self.num_channels = self.positions.shape[0]
+        # elements on a line can not resolve elevation
+        centered = self.positions - self.positions.mean(axis=0)
+        self.is_linear = np.linalg.matrix_rank(centered) <= 1
+
+    @classmethod
+    def line_array(cls, num_channels, dx):
+        """uniform line array along the x axis with spacing dx"""
+        positions = np.zeros((num_channels, 3))
+        positions[:, 0] = np.arange(num_channels) * dx
+        return cls(positions)
+
+    def __eq__(self, other):
+        """Geometries are the same if all element positions are the same"""
+        return isinstance(other, ArrayGeometry) \
+               and np.array_equal(self.positions, other.positions)
+
+    def __hash__(self):
+        """Hash of element positions, used to cache steering tables"""
+        return hash(self.positions.tobytes())
+
+    def steering(self, fc, c, azimuths, elevations=0.):
+        """Steering vectors, shape (num_channels,) + broadcast angle shape
+        These are the baseband phases of a plane wave from each direction
+        """
+        azimuths, elevations = np.broadcast_arrays(azimuths, elevations)
+        cos_el = np.cos(elevations)
+        # unit vector of each look direction
+        u = np.stack([np.sin(azimuths) * cos_el,
+                      np.cos(azimuths) * cos_el,
+                      np.sin(elevations)])
+        k = 2 * pi * fc / c
+        phase = np.tensordot(self.positions, u, axes=(1, 0))
+        return np.exp(1j * k * phase)
+
+
+_tables = OrderedDict()
+max_tables = 32  # number of cached steering tables
+
+
+def _cached(key, compute):
+    """Cached read only table, compute() makes it when it is not saved. The
+    least recently used table is dropped when the cache is full.
+    """
+    if key in _tables:
+        _tables.move_to_end(key)
+        return _tables[key]
+    table = compute()
+    table.flags.writeable = False
+    _tables[key] = table
+    if len(_tables) > max_tables:
+        _tables.popitem(last=False)
+    return table
+
+
+def steering_table(geometry, fc, c, azimuths, elevations):
+    """Cached steering vectors of an azimuth, elevation grid
+    output shape is (num_channels, num_elevations, num_azimuths)
+    """
+    azimuths = np.asarray(azimuths, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+    key = ('grid', geometry, fc, c, azimuths.tobytes(), elevations.tobytes())
+    return _cached(key, lambda: geometry.steering(fc, c,
+                                                  azimuths[None, :],
+                                                  elevations[:, None]))
+
+
+def fine_steering_table(geometry, fc, c, fine_azimuths, fine_elevations):
+    """Cached steering vectors of a fine grid around every coarse direction
+    fine_azimuths has shape (num_azimuths, num_fine_az), the fine azimuths of
+    each coarse azimuth, and fine_elevations has shape (num_elevations,
+    num_fine_el)
+    output shape is (num_elevations, num_azimuths, num_channels,
+    num_fine_el * num_fine_az)
+    """
+    fine_azimuths = np.asarray(fine_azimuths, dtype=np.float64)
+    fine_elevations = np.asarray(fine_elevations, dtype=np.float64)
+    key = ('fine', geometry, fc, c, fine_azimuths.tobytes(),
+           fine_azimuths.shape, fine_elevations.tobytes(),
+           fine_elevations.shape)
+
+    def compute():
+        """fine grids of all coarse directions in one call"""
+        table = geometry.steering(fc, c,
+                                  fine_azimuths[None, :, None, :],
+                                  fine_elevations[:, None, :, None])
+        num_el, num_az = table.shape[1: 3]
+        table = np.moveaxis(table, 0, 2)
+        return np.ascontiguousarray(table).reshape(num_el, num_az,
+                                                   geometry.num_channels, -1)
+    return _cached(key, compute)
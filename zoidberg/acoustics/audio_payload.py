@@ -0,0 +1,55 @@
+"""
+=============
+Audio payload
+=============
+Pack complex single frequency samples into the byte payload of an
+audio_data_v2_t message, and unpack them with no intermediate python lists.
+Samples are sent either as little endian complex64, or as interleaved real and
+imaginary int16 values with a scale factor to halve the message size.
+"""
+import numpy as np
+
+# payload encoding flags
+COMPLEX64 = 0
+INT16 = 1
+
+int16_max = np.iinfo(np.int16).max
+
+
+def encode_samples(msg, samples, encoding=COMPLEX64):
+    """Fill payload fields of an audio_data_v2_t from complex samples
+    samples has shape (num_channels, num_samples)
+    """
+    msg.num_channels, msg.num_samples = samples.shape
+    msg.encoding = encoding
+    if encoding == COMPLEX64:
+        msg.scale = 1.
+        payload = np.ascontiguousarray(samples, dtype='<c8')
+    elif encoding == INT16:
+        # real and imaginary values as a float32 pair
+        pairs = np.ascontiguousarray(samples, dtype=np.complex64)
+        pairs = pairs.view(np.float32)
+        peak = np.max(np.abs(pairs)) if pairs.size else 0.
+        msg.scale = float(peak / int16_max) if peak > 0 else 1.
+        scaled = pairs / np.float32(msg.scale)
+        np.rint(scaled, out=scaled)
+        payload = scaled.astype('<i2')
+    else:
+        raise ValueError('Unknown encoding {}'.format(encoding))
+    msg.samples = payload.tobytes()
+    msg.num_bytes = len(msg.samples)
+
+
+def decode_samples(msg):
+    """Complex64 array of shape (num_channels, num_samples) from a message"""
+    shape = (msg.num_channels, msg.num_samples)
+    if msg.encoding == COMPLEX64:
+        # zero copy, the array is a read only view of the message payload
+        return np.frombuffer(msg.samples, dtype='<c8').reshape(shape)
+    elif msg.encoding == INT16:
+        pairs = np.frombuffer(msg.samples, dtype='<i2')
+        samples = np.empty(shape, dtype=np.complex64)
+        np.multiply(pairs, np.float32(msg.scale),
+                    out=samples.view(np.float32).reshape(-1))
+        return samples
+    raise ValueError('Unknown encoding {}'.format(msg.encoding))
@@ -6,14 +6,32 @@ Compute acoustic energy at a single frequency. This is equivalent to computing
 a single bin of an discrete fourier transform. This result, p_atfc, can be
 compaired across multiple channels to get a bearing estimate, a process called
 beamforming.
+
+In event transmission, a CFAR energy trigger runs on the processed samples,
+and only windows around triggers are sent. Each window starts num_pre samples
+before the trigger, so the node has a full noise reference for its own
+detector, and ends num_post samples after the last trigger. Sample index and
+time stamps are the same as in continuous transmission, so the node sees the
+samples between windows as missing data. A summary of the noise floor is
+published every keepalive_time, so the beagle is heard while no pings are sent.
 """
 import numpy as np
 from math import pi
+from time import time, sleep
+import threading
 import pyaudio
 import lcm
 
-from zoidberg_lcm import audio_data_t
-from zoidberg import timestamp
+from zoidberg_lcm import audio_data_v2_t, audio_status_t
+from sliding_dft import SlidingDFT
+from int24_decoder import Int24Decoder
+import audio_payload
+from recording import RawRecorder, records
+from capture_ring import CaptureRing
+from decimator import BasebandDecimator
+from stft import STFT
+from cfar import CfarDetector
+from ring_buffer import RingBuffer
 
 
 fs = 96000  # sampling frequency
@@ -36,7 +54,7 @@ num_step = int(np.floor(winwidth * (1 - overlap)))
 
 # compute integer number of section positions
 num_sections = buffer_size // num_step
-section_lengths = np.ones(num_sections, dtype=np.int) * num_step
+section_lengths = np.ones(num_sections, dtype=int) * num_step
 section_lengths[: buffer_size % num_sections] += 1
 
 # all section with start indicies inside of a buffer
@@ -56,13 +74,29 @@ for k in range(len(nuttall3b)):
 
 class BeagleFirmware:
     """Compute single frequency result continously, beamform at each ping"""
-    def __init__(self, fc, sim_gen=None):
-        """fc is frequency of interest
+    def __init__(self, fc, sim_gen=None, encoding=audio_payload.COMPLEX64,
+                 record_dir=None, capture='blocking', audio=None,
+                 decimation=1, search_band=None, transmit='continuous'):
+        """fc is frequency of interest, or a list of frequencies. A list of
+        frequencies are all computed in one pass over each buffer.
         sim_gen is a generater object used for simulation. Each time next()
         is called on it, it is expected to return a buffer like array
+        encoding is the LCM payload type, complex64 or scaled int16
+        record_dir is a folder to save raw sound card buffers, see recording
+        capture is blocking, where spin reads the stream, or callback, where
+        the stream callback fills a ring of buffers and a separate thread
+        processes them
+        audio replaces pyaudio.PyAudio(), for example with a fake stream
+        decimation is the factor by which the sections are reduced before
+        they are sent, after conversion to complex baseband, see decimator
+        search_band is a (low, high) frequency range, (Hz). When given, fc is
+        found by a search of this band, and fc is only the starting guess. It
+        may be None to start at the center of the band.
+        transmit is continuous, where every processed sample is sent, or
+        event, where only windows around an energy trigger are sent
         """
-        # center frequency that we are looking for
-        self.fc = fc
+        if fc is None:
+            fc = int(np.mean(search_band))
 
         # ADC data conversion stuff
         self.fs = fs
@@ -71,9 +105,8 @@ class BeagleFirmware:
         self.num_channels = 3
         self.num_bytes = 3
 
-        # Convert values to -1, 1 range
-        in_range = 2 ** (8 * self.num_bytes - 1)
-        self.int_to_float = 1 / in_range
+        # Convert values to -1, 1 range, output is (channels, samples)
+        self.decoder = Int24Decoder(self.num_channels, self.buffer_size)
 
         # decimation of the input data. Processing happens on chuncks of data
         self.window = window
@@ -81,106 +114,423 @@ class BeagleFirmware:
         # number of samples to move each calculation
         self.num_step = num_step
 
-        # precompute twidle factors
-        # https://forum.bela.io/d/799-high-frequency-narrow-banded-beamforming
-        self.twidle = np.exp(-1j * 2 * pi * self.fc / self.fs
-                             * np.arange(self.winwidth))
-        self.twidle *= self.window
-        self.twidle.astype(np.complex64)
+        # time of first processed sample from start of first section, (s)
+        self.time_offset = 0.
+        # number of processed samples sent before the current buffer
+        self.sample_index = 0
+        self.encoding = encoding
+
+        # event transmission sends windows around triggers, see encode
+        if transmit not in ('continuous', 'event'):
+            raise ValueError('Unknown transmit mode {}'.format(transmit))
+        self.transmit = transmit
+        self.num_pre = 96  # samples sent before a trigger, > node cfar window
+        self.num_post = 32  # samples sent after the last trigger
+        self.trigger_pfa = 1e-6  # false alarm rate of trigger
+        self.keepalive_time = 1.  # time between noise summaries, (s)
+        self.num_triggers = 0
+        self.trigger = None
+        self._history = None
 
-        # main filter is a large matrix that processes all data with no overlap
-        main_filter = []
-        for mi in main_i:
-            temp = np.zeros(buffer_size, dtype=np.complex64)
-            temp[mi: mi + self.winwidth] = self.twidle.copy()
-            main_filter.append(temp)
-        self.main_filter = np.array(main_filter).T
-
-        # tail filter is a small matrix that processes data that is overlaped
-        self.old_tail_size = self.buffer_size - tail_i[0]
-        self.tail_size = self.old_tail_size + winwidth
-        self.new_tail_size = self.tail_size - self.old_tail_size
-
-        tail_filter = []
-        for mi in tail_i - tail_i[0]:
-            temp = np.zeros(self.tail_size, dtype=np.complex64)
-            temp[mi: mi + self.winwidth] = self.twidle.copy()
-            tail_filter.append(temp)
-        self.tail_filter = np.array(tail_filter).T
-
-        # create a buffer to save samples needed in overlap correction
-        self.old_tail = np.zeros((self.num_channels, self.old_tail_size),
-                                 dtype=np.float32)
+        # optional baseband decimation of the sections
+        self.decimation = decimation
+        self.dft = None
+        self.decimator = None
+        self.set_fc(fc)
+
+        # band search runs an STFT of every buffer until a ping is found
+        self.search_band = search_band
+        self.search_time = 2.  # length of waterfall searched, (s)
+        self.search_snr = 10.  # detection threshold of search, (dB)
+        self.stft = None
+        if search_band is not None:
+            self.stft = STFT(self.window, self.num_step, self.buffer_size,
+                             self.num_channels, self.fs,
+                             waterfall_time=self.search_time)
+
+        # raw data recording
+        self.record_dir = record_dir
+        self.recorder = None
+        # number of raw frames read from the sound card
+        self.raw_index = 0
+
+        # callback capture hands raw buffers to a consumer thread
+        if capture not in ('blocking', 'callback'):
+            raise ValueError('Unknown capture mode {}'.format(capture))
+        self.capture = capture
+        self.ring_size = 16  # number of raw buffers in capture ring
+        self.ring = None
+        self.stop_threads = False
+        self.consumer = None
+        # number of frames seen by the stream callback
+        self.callback_index = 0
+        # sound card status flags, flagged or partial callbacks are dropped
+        self.num_input_overflows = 0
+        self.num_underruns = 0
 
         # pyaudio and LCM setup
         self.sim_gen = sim_gen
+        self.audio = audio
         self.p = None
         self.stream = None
         self.lc = lcm.LCM()
 
+    def set_fc(self, fc):
+        """Change the frequency of interest, or list of frequencies. Saved
+        samples are kept, so processing continues without a gap.
+        """
+        # center frequency that we are looking for
+        self.fc = fc
+        # filter bank mode computes a bin for each center frequency
+        self.is_bank = not np.isscalar(fc)
+        self.fcs = [int(round(f)) for f in np.atleast_1d(fc)]
+
+        # precompute twidle factors
+        # https://forum.bela.io/d/799-high-frequency-narrow-banded-beamforming
+        self.twidle = np.exp(-1j * 2 * pi * np.array(self.fcs) / self.fs
+                             * np.arange(self.winwidth)[:, None])
+        self.twidle *= self.window[:, None]
+        if not self.is_bank:
+            self.twidle = self.twidle[:, 0]
+        self.twidle.astype(np.complex64)
+
+        # sliding DFT only computes winwidth multiplies per section
+        old_dft = self.dft
+        self.dft = SlidingDFT(self.twidle, all_i, self.buffer_size,
+                              self.num_channels)
+        if old_dft is not None:
+            self.dft.stream[:] = old_dft.stream
+
+        if self.decimation > 1:
+            old_decimator = self.decimator
+            section_offsets = np.hstack([tail_i - self.buffer_size, main_i])
+            self.decimator = BasebandDecimator(self.fcs, self.fs,
+                                               section_offsets,
+                                               self.buffer_size,
+                                               self.num_channels,
+                                               self.decimation)
+            if old_decimator is not None:
+                self.decimator.skip(old_decimator.buffer_count)
+
+        if self.transmit == 'event':
+            self._reset_trigger()
+
+    def _reset_trigger(self):
+        """Restart the event trigger, pre-trigger history and noise summary.
+        The trigger searches every channel of every frequency.
+        """
+        num_rows = len(self.fcs) * self.num_channels
+        self.trigger = CfarDetector(num_rows, pfa=self.trigger_pfa)
+        # longest window of a buffer is the pre-trigger history and the
+        # processed samples of one buffer
+        capacity = self.num_pre + len(all_i)
+        self._history = RingBuffer(num_rows, capacity)
+        self._history.skip(self.sample_index)
+        # absolute sample index of the first sample not sent, and the end of
+        # the current window
+        self._sent_i = self.sample_index
+        self._send_end = self.sample_index
+        # noise power summed over samples outside of windows
+        self._noise_sum = np.zeros(num_rows)
+        self._noise_count = 0
+        self._status_time = None
+
+    def search(self, recorded_data):
+        """Add a buffer to the band search, and change fc once a pinger is
+        found. returns True when fc was changed
+        """
+        self.stft.process(recorded_data)
+        peak = self.stft.peak_frequency(band=self.search_band,
+                                        min_snr=self.search_snr)
+        if peak is None:
+            return False
+        self.set_fc(peak)
+        self.stft = None
+        return True
+
     def isactive(self, to_arm):
         """startup or shutdown data stream from audio card"""
-        if self.sim_gen is None:
+        if self.sim_gen is not None:
             return
 
         if to_arm:
-            self.p = pyaudio.PyAudio()
-            self.stream = self.p.open(format=self.in_format,
-                                      channels=self.num_channels,
-                                      rate=self.fc,
-                                      input=True,
-                                      frames_per_buffer=self.buffer_size)
+            if self.record_dir is not None:
+                self.recorder = RawRecorder(self.record_dir,
+                                            self.num_channels,
+                                            self.buffer_size,
+                                            self.fs,
+                                            num_bytes=self.num_bytes)
+            self.p = self.audio if self.audio is not None \
+                     else pyaudio.PyAudio()
+            stream_args = dict(format=self.in_format,
+                               channels=self.num_channels,
+                               rate=self.fs,
+                               input=True,
+                               frames_per_buffer=self.buffer_size)
+            if self.capture == 'callback':
+                bytes_per_buffer = self.num_channels * self.buffer_size \
+                                 * self.num_bytes
+                self.ring = CaptureRing(self.ring_size, bytes_per_buffer)
+                self.callback_index = self.raw_index
+                self.stop_threads = False
+                self.consumer = threading.Thread(target=self._get_consumer())
+                self.consumer.start()
+                stream_args['stream_callback'] = self._get_callback()
+            self.stream = self.p.open(**stream_args)
         else:
             if self.stream is not None:
                 self.stream.stop_stream()
                 self.stream.close()
-                self.p.terminate
+                self.p.terminate()
+                self.stream = None
+            if self.consumer is not None:
+                self.stop_threads = True
+                self.consumer.join()
+                self.consumer = None
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
 
     def spin(self):
-        """Process one frame at a time, put into an infinite loop"""
+        """Process one frame at a time, put into an infinite loop
+        In callback capture, processing happens on its own thread and spin
+        only waits.
+        """
         if self.sim_gen is None:
+            if self.capture == 'callback':
+                sleep(self.buffer_size / self.fs)
+                return
             # read data from stream object and process it
             data = self.stream.read(self.buffer_size)
-            recorded_data = self._buf_to_np(data)
+            utime = int(time() * 1e6)
+            self._process_raw(data, self.raw_index, utime)
         else:
             # pull next record for generator
             recorded_data = next(self.sim_gen)
+            utime = int(time() * 1e6)
+            self._publish(self.process(recorded_data), utime)
+
+    def replay(self, record_dir, realtime=False):
+        """Process and publish a recording made with record_dir. Recorded
+        sample counters and times are used, so dropped buffers are handled
+        as they were during the session.
+        """
+        for data, frame_index, utime in records(record_dir, realtime):
+            if self.raw_index == 0:
+                # recording may start after the first frame
+                self.raw_index = frame_index
+            self._process_raw(data, frame_index, utime)
+
+    def _process_raw(self, data, frame_index, utime):
+        """Record, process and publish one buffer of raw bytes"""
+        if frame_index != self.raw_index:
+            # buffers were dropped, keep the sample index aligned. A partial
+            # drop is a whole buffer, the dft is restarted either way
+            missing = -(-(frame_index - self.raw_index) // self.buffer_size)
+            if self.decimator is None:
+                self.sample_index += missing * self.dft.num_sections
+            else:
+                self.sample_index += self.decimator.skip(missing)
+            self.dft.reset()
+        if self.recorder is not None:
+            self.recorder.write(data, frame_index, utime)
+        self.raw_index = frame_index + self.buffer_size
+        self._publish(self.process(self._buf_to_np(data)), utime)
+
+    def _publish(self, processed_data, utime):
+        """send result out over lcm"""
+        for data in self.encode(processed_data, utime):
+            self.lc.publish("ACOUSTICS", data)
+        for data in self.encode_status(utime):
+            self.lc.publish("ACOUSTICS_STATUS", data)
+
+    def _get_callback(self):
+        """return a PyAudio stream callback that copies each buffer into the
+        capture ring, without any processing
+        """
+        def stream_callback(in_data, frame_count, time_info, status):
+            """Function to allow self to be used between threads"""
+            utime = int(time() * 1e6)
+            # samples were lost before or in this buffer, so it is not
+            # processed and the next buffer starts after a gap
+            is_lost = False
+            if status & pyaudio.paInputOverflow:
+                self.num_input_overflows += 1
+                is_lost = True
+            if status & pyaudio.paInputUnderflow \
+                    or frame_count != self.buffer_size:
+                self.num_underruns += 1
+                is_lost = True
+            if not is_lost:
+                self.ring.put(in_data, self.callback_index, utime)
+            self.callback_index += frame_count
+            return (None, pyaudio.paContinue)
+        return stream_callback
+
+    def _get_consumer(self):
+        """return a function that processes buffers from the capture ring in
+        a seperate thread
+        """
+        tout = self.buffer_size / self.fs / 4  # wait when ring is empty
+        def consumer_loop():
+            """Function to allow self to be used between threads"""
+            while not self.stop_threads:
+                item = self.ring.get()
+                if item is None:
+                    sleep(tout)
+                    continue
+                self._process_raw(*item)
+                self.ring.release()
+        return consumer_loop
+
+    def capture_stats(self):
+        """Counters of callback capture"""
+        return dict(num_captured=self.ring.num_written,
+                    num_processed=self.ring.num_read,
+                    num_overruns=self.ring.num_overruns,
+                    num_input_overflows=self.num_input_overflows,
+                    num_underruns=self.num_underruns,
+                    depth=self.ring.depth,
+                    high_water=self.ring.high_water)
+
+    def encode(self, processed_data, utime):
+        """Encode processed data as audio_data_v2_t messages, one message for
+        each frequency. Advances the sample index.
+        utime is the epoch time of the first section of the buffer, (us)
+        In event transmission, only samples inside a trigger window are
+        encoded, and most buffers have no messages.
+        """
+        if not self.is_bank:
+            processed_data = processed_data[None, :, :]
+        utime += int(round(self.time_offset * 1e6))
+
+        if self.transmit == 'event':
+            encoded = self._encode_event(processed_data, utime)
+        else:
+            encoded = [self._encode_msg(fc, fc_data, self.sample_index, utime)
+                       for fc, fc_data in zip(self.fcs, processed_data)]
+        self.sample_index += processed_data.shape[-1]
+        return encoded
 
-        processed_data = self.process(recorded_data)
-        # send result out over lcm
-        msg = audio_data_t()
-        msg.timestamp = timestamp()
-        msg.num_channels, msg.num_samples = processed_data.shape
-        msg.fc = self.fc
-        msg.num_step = self.num_step
+    def _encode_msg(self, fc, fc_data, sample_index, utime):
+        """Encode samples of one frequency, utime is time of first sample"""
+        msg = audio_data_v2_t()
+        msg.utime = utime
+        msg.sample_index = sample_index
+        msg.fc = fc
+        msg.num_step = self.num_step * self.decimation
         msg.fs = self.fs
-        msg.re_samples = processed_data.real
-        msg.im_samples = processed_data.imag
-        self.lc.publish("ACOUSTICS", msg.encode())
+        audio_payload.encode_samples(msg, fc_data, self.encoding)
+        return msg.encode()
+
+    def _encode_event(self, processed_data, utime):
+        """Trigger on the latest samples, and encode any samples of a window
+        processed_data has shape (num_fc, num_channels, num_samples)
+        """
+        num_fc, _, num_samples = processed_data.shape
+        samples = processed_data.reshape(-1, num_samples)
+        start = self.sample_index
+        end = start + num_samples
+
+        gap = start - self._history.count
+        if gap > 0:
+            # buffers were dropped, noise reference is no longer valid
+            self._history.skip(gap)
+            self.trigger.reset()
+        self._history.append(samples)
+        over_i = np.flatnonzero(self.trigger.detect(samples))
+
+        # samples before a trigger are noise, and are summarized
+        is_quiet = np.arange(start, end) >= self._send_end
+        if over_i.size:
+            is_quiet[over_i[0]:] = False
+        power = samples[:, is_quiet]
+        self._noise_sum += np.sum(power.real ** 2 + power.imag ** 2, axis=1)
+        self._noise_count += power.shape[1]
+
+        # a window continues until num_post samples after the last trigger
+        send_start = self._sent_i if self._send_end > start else end
+        if over_i.size:
+            if start + over_i[0] >= self._send_end:
+                self.num_triggers += 1
+            send_start = min(send_start, start + over_i[0] - self.num_pre)
+            self._send_end = max(self._send_end,
+                                 start + over_i[-1] + 1 + self.num_post)
+        send_start = max(send_start, self._sent_i, self._history.first)
+        send_end = min(end, self._send_end)
+        if send_end <= send_start:
+            return []
+        self._sent_i = send_end
+
+        # time of window start, history samples are from earlier buffers
+        dt = self.num_step * self.decimation / self.fs
+        window_utime = utime + int(round((send_start - start) * dt * 1e6))
+        window = self._history.get(send_start, send_end - send_start)
+        window = window.reshape(num_fc, self.num_channels, -1)
+        return [self._encode_msg(fc, fc_data, send_start, window_utime)
+                for fc, fc_data in zip(self.fcs, window)]
+
+    def encode_status(self, utime):
+        """Encode audio_status_t noise summaries, one for each frequency, once
+        every keepalive_time. Only sent in event transmission.
+        utime is the epoch time of the latest buffer, (us)
+        """
+        if self.transmit != 'event':
+            return []
+        if self._status_time is not None \
+                and utime - self._status_time < self.keepalive_time * 1e6:
+            return []
+        self._status_time = utime
+
+        noise_floor = self._noise_sum / max(self._noise_count, 1)
+        noise_floor = noise_floor.reshape(len(self.fcs), self.num_channels)
+        self._noise_sum[:] = 0
+        self._noise_count = 0
+
+        encoded = []
+        for fc, fc_noise in zip(self.fcs, noise_floor):
+            msg = audio_status_t()
+            msg.utime = utime
+            msg.sample_index = self.sample_index
+            msg.fc = fc
+            msg.num_channels = self.num_channels
+            msg.noise_floor = fc_noise.tolist()
+            msg.num_triggers = self.num_triggers
+            encoded.append(msg.encode())
+        return encoded
 
     def process(self, recorded_data):
         """
         Compute single frequency samples from a recorded time series
+        output has shape (num_channels, num_sections), or
+        (num_fc, num_channels, num_sections) in filter bank mode
+        With decimation, the number of sections is reduced, and time_offset
+        is the time of the first output relative to the first section.
         """
-        # compute results from tail of previous buffer
-        all_tail = np.concatenate([self.old_tail,
-                                   recorded_data[:, :self.new_tail_size]],
-                                   axis=1)
-        # compute acoustic values as a vector multiply
-        tail_atfc = all_tail @ self.tail_filter
-        main_atfc = recorded_data @ self.main_filter
-        # record tail values for next time around
-        self.old_tail = recorded_data[:, -self.old_tail_size:].copy()
-        return np.concatenate([tail_atfc, main_atfc], axis=1)
+        if self.stft is not None:
+            self.search(recorded_data)
+        processed_data = self.dft.process(recorded_data)
+        if self.decimator is not None:
+            processed_data, offset = self.decimator.process(processed_data)
+            self.time_offset = offset * self.num_step / self.fs
+        if self.is_bank:
+            # frequency is the first axis, this is a view
+            processed_data = np.moveaxis(processed_data, 2, 0)
+        return processed_data
+
+    def reset(self):
+        """Clear saved samples and restart the sample index"""
+        self.dft.reset()
+        if self.decimator is not None:
+            self.decimator.reset()
+        self.sample_index = 0
+        if self.transmit == 'event':
+            self._reset_trigger()
 
     def _buf_to_np(self, buf):
         """Convert a buffer of bytes to numpy array
         in: N channel int24 buffer
-        out: float32 numpy array"""
-        a = np.ndarray(len(buf), np.dtype('<i1'), buf)
-        e = np.zeros(int(len(buf) // self.num_bytes), np.dtype('<i4'))
-        for i in range(self.num_bytes):
-            # e is offset by 1, this makes LSB 0 (up-casting data type)
-            e.view(dtype='<i1')[i + 1::4] = a.view(dtype='<i1')[i::3]
-        result = np.array(e, dtype='float32') * self.int_to_float
-        return result.reshape(-1, self.num_channels)
+        out: float32 numpy array, shape (num_channels, buffer_size)
+        The output array is reused for each buffer.
+        """
+        return self.decoder.decode(buf)
@@ -0,0 +1,250 @@
+"""
+==========
+Beamformer
+==========
+Estimate bearing from the cross-spectral matrix of a ping. Beam power is first
+computed on a coarse grid of azimuth and elevation look directions, then on a
+fine grid around the coarse peak. The fine peak is refined below the grid
+spacing by fitting a parabola through the peak and its neighbors along each
+angle.
+
+Three estimators are available, all of which are a quadratic form of the
+steering vectors with a matrix computed once per ping:
+
+* bartlett: conventional beamformer, a^H K a
+* mvdr: minimum variance distortionless response, 1 / (a^H K^-1 a)
+* music: multiple signal classification, 1 / (a^H E_n E_n^H a), where E_n are
+  the noise subspace eigenvectors of K
+
+Cross-spectral matrices can be stacked along a first axis to beamform a batch
+of pings in one call.
+"""
+import numpy as np
+from math import pi
+
+from array_geometry import ArrayGeometry, steering_table, \
+                           fine_steering_table
+
+methods = ('bartlett', 'mvdr', 'music')
+
+
+class Beamformer:
+    """Coarse to fine beamformer for an arbitrary array geometry"""
+    def __init__(self, geometry, fc, c, azimuths=None, elevations=None,
+                 num_fine=4, method='bartlett'):
+        """geometry is an ArrayGeometry, or element positions along the x axis
+        fc is the center frequency, c is the speed of sound
+        azimuths and elevations are the coarse grid of look directions. By
+        default a line array scans azimuth from -pi / 2 to pi / 2, other arrays
+        scan all azimuths and elevations
+        num_fine is the number of fine look directions between coarse neighbors
+        method is one of bartlett, mvdr or music
+        """
+        if method not in methods:
+            raise ValueError('Unknown beamformer method {}'.format(method))
+        if not isinstance(geometry, ArrayGeometry):
+            element_x = np.asarray(geometry, dtype=np.float64)
+            positions = np.zeros((element_x.size, 3))
+            positions[:, 0] = element_x
+            geometry = ArrayGeometry(positions)
+        self.method = method
+        self.geometry = geometry
+        self.num_channels = geometry.num_channels
+        self.fc = fc
+        self.c = c
+
+        # mvdr diagonal loading, relative to average channel power
+        self.loading = 1e-3
+        # number of sources assumed by music
+        self.num_sources = 1
+
+        # coarse grid is scanned for every ping
+        if azimuths is None:
+            if geometry.is_linear:
+                azimuths = np.linspace(-pi / 2, pi / 2, 37)
+            else:
+                azimuths = np.arange(72) * 2 * pi / 72 - pi
+        if elevations is None:
+            if geometry.is_linear:
+                elevations = [0.]
+            else:
+                elevations = np.linspace(-pi / 2, pi / 2, 19)
+        self.azimuths = np.asarray(azimuths, dtype=np.float64)
+        self.elevations = np.asarray(elevations, dtype=np.float64)
+        self.az_step = self._step(self.azimuths)
+        self.el_step = self._step(self.elevations)
+        # azimuth only wraps around when all directions are scanned
+        self.az_limits = (-pi / 2, pi / 2) if geometry.is_linear \
+                         else (-np.inf, np.inf)
+
+        # shape (num_channels, num_elevations * num_azimuths)
+        self.coarse_vectors = steering_table(geometry, fc, c,
+                                             self.azimuths,
+                                             self.elevations)
+        self.coarse_vectors = self.coarse_vectors.reshape(self.num_channels,
+                                                          -1)
+
+        # fine grids span the two coarse neighbors of the coarse peak
+        fine = np.linspace(-1, 1, 2 * num_fine + 1)
+        self.az_offsets = fine * self.az_step
+        self.el_offsets = fine * self.el_step if self.el_step else np.zeros(1)
+        self.fine_az_step = self._step(self.az_offsets)
+        self.fine_el_step = self._step(self.el_offsets)
+        # fine look directions of each coarse azimuth and elevation
+        self.fine_azimuths = np.clip(self.azimuths[:, None] + self.az_offsets,
+                                     *self.az_limits)
+        self.fine_elevations = np.clip(self.elevations[:, None]
+                                       + self.el_offsets, -pi / 2, pi / 2)
+        # fine steering vectors are precomputed around every coarse direction
+        # shape (num_elevations, num_azimuths, num_channels, num_fine)
+        self.fine_vectors = fine_steering_table(geometry, fc, c,
+                                                self.fine_azimuths,
+                                                self.fine_elevations)
+
+    @staticmethod
+    def _step(angles):
+        """Spacing of a uniform angle grid, 0 for a single angle"""
+        return angles[1] - angles[0] if angles.size > 1 else 0.
+
+    def steering(self, azimuths, elevations=0.):
+        """Steering vectors, shape (num_channels,) + broadcast angle shape"""
+        return self.geometry.steering(self.fc, self.c, azimuths, elevations)
+
+    def cross_spectral(self, beams):
+        """Cross-spectral matrix of snapshots, shape (..., channels, snapshots)
+        K = b b^H, so that a^H K a peaks when the steering vector a matches
+        the phases b of the arrival
+        """
+        num_snapshots = beams.shape[-1]
+        return beams @ np.conj(np.swapaxes(beams, -1, -2)) / num_snapshots
+
+    def power(self, K, vectors):
+        """Beam power of cross-spectral matrix K for each steering vector"""
+        return self._spectrum(self.estimator_matrix(K), vectors)
+
+    def estimator_matrix(self, K):
+        """Matrix used in the quadratic form of the estimator, once per ping
+        """
+        if self.method == 'bartlett':
+            return K
+        eye = np.eye(self.num_channels)
+        if self.method == 'mvdr':
+            trace = np.trace(K, axis1=-2, axis2=-1).real
+            load = self.loading * trace / self.num_channels
+            return np.linalg.inv(K + load[..., None, None] * eye)
+        # music noise subspace projection, eigenvalues are ascending
+        _, vecs = np.linalg.eigh(K)
+        noise = vecs[..., :self.num_channels - self.num_sources]
+        return noise @ np.conj(np.swapaxes(noise, -1, -2))
+
+    def _spectrum(self, M, vectors):
+        """Estimator output for quadratic form matrix M"""
+        quad = np.real(np.sum(np.conj(vectors) * (M @ vectors), axis=-2))
+        if self.method == 'bartlett':
+            return quad
+        return 1 / np.maximum(quad, np.finfo(np.float64).tiny)
+
+    def beamform(self, K):
+        """Estimate direction of arrival from the cross-spectral matrix K
+        K has shape (num_channels, num_channels), or a batch of pings with
+        shape (num_pings, num_channels, num_channels)
+        returns azimuth, elevation, peak power and -3 dB azimuth beam width,
+        all angles in radians. Beam width is measured on the coarse grid, and
+        is NaN when the beam does not fall to half power within the scan.
+        """
+        is_batch = K.ndim == 3
+        if not is_batch:
+            K = K[None, :, :]
+        num_pings = K.shape[0]
+        pings = np.arange(num_pings)
+        num_el = self.elevations.size
+        num_az = self.azimuths.size
+
+        # the estimator matrix (inverse, subspace) is computed once per ping
+        M = self.estimator_matrix(K)
+
+        # coarse scan of the whole grid
+        coarse_power = self._spectrum(M, self.coarse_vectors)
+        coarse_power = coarse_power.reshape(num_pings, num_el, num_az)
+        ei, ai = np.unravel_index(np.argmax(coarse_power.reshape(num_pings,
+                                                                 -1),
+                                            axis=-1),
+                                  (num_el, num_az))
+
+        # fine scan around coarse peak
+        fine_az = self.fine_azimuths[ai]
+        fine_el = self.fine_elevations[ei]
+        # shape (num_pings, num_channels, num_fine_el * num_fine_az)
+        fine_vectors = self.fine_vectors[ei, ai]
+        fine_power = self._spectrum(M, fine_vectors)
+        fine_power = fine_power.reshape(num_pings,
+                                        self.el_offsets.size,
+                                        self.az_offsets.size)
+        fe, fa = np.unravel_index(np.argmax(fine_power.reshape(num_pings, -1),
+                                            axis=-1),
+                                  fine_power.shape[1:])
+        azimuth = fine_az[pings, fa]
+        elevation = fine_el[pings, fe]
+        peak = fine_power[pings, fe, fa]
+
+        # parabolic interpolation between fine grid points along each angle
+        d_az, dp_az = self._parabolic(fine_power[pings, fe, :], fa)
+        d_el, dp_el = self._parabolic(fine_power[pings, :, fa], fe)
+        azimuth = azimuth + d_az * self.fine_az_step
+        elevation = elevation + d_el * self.fine_el_step
+        peak = peak + dp_az + dp_el
+
+        width = self._beam_width(coarse_power[pings, ei, :], ai)
+        if not is_batch:
+            return azimuth[0], elevation[0], peak[0], width[0]
+        return azimuth, elevation, peak, width
+
+    @staticmethod
+    def _parabolic(power, i):
+        """Offset and peak correction of a parabola through a peak at i"""
+        num_pings, num_fine = power.shape
+        delta = np.zeros(num_pings)
+        correction = np.zeros(num_pings)
+        if num_fine < 3:
+            return delta, correction
+        pings = np.arange(num_pings)
+        i_c = np.clip(i, 1, num_fine - 2)
+        p_l = power[pings, i_c - 1]
+        p_c = power[pings, i_c]
+        p_r = power[pings, i_c + 1]
+        curve = p_l - 2 * p_c + p_r
+        is_valid = (i == i_c) & (curve < 0)
+        delta[is_valid] = 0.5 * (p_l - p_r)[is_valid] / curve[is_valid]
+        correction[is_valid] = -0.25 * (p_l - p_r)[is_valid] \
+                             * delta[is_valid]
+        return delta, correction
+
+    def _beam_width(self, coarse_power, ci):
+        """Width of coarse azimuth beam pattern above half of the peak power,
+        NaN when the beam does not fall to half power on both sides
+        """
+        num_pings, num_coarse = coarse_power.shape
+        pings = np.arange(num_pings)
+        half = coarse_power[pings, ci][:, None] / 2
+        # a scan of all azimuths wraps around at +-pi
+        is_circular = np.isclose(self.az_step * num_coarse, 2 * pi)
+        steps = np.arange(num_coarse)
+
+        width = np.zeros(num_pings)
+        for sign in (-1, 1):
+            index = ci[:, None] + sign * steps
+            is_inside = (index >= 0) & (index < num_coarse)
+            if is_circular:
+                index %= num_coarse
+                is_inside[:] = True
+            power = coarse_power[pings[:, None],
+                                 np.clip(index, 0, num_coarse - 1)]
+            below = is_inside & (power < half)
+            # first grid point below half power, and the one before it
+            step = np.argmax(below, axis=-1)
+            p_0 = power[pings, np.maximum(step - 1, 0)]
+            p_1 = power[pings, step]
+            frac = (p_0 - half[:, 0]) / np.where(p_0 != p_1, p_0 - p_1, 1)
+            edge = step - 1 + np.clip(frac, 0, 1)
+            width += np.where(np.any(below, axis=-1), edge, np.nan)
+        return width * self.az_step
@@ -5,7 +5,8 @@ from scipy.signal.windows import hann
 import matplotlib.pyplot as plt
 from time import sleep
 
-from beagle_firmware import BeagleFirmware
+from beagle_firmware import BeagleFirmware, buffer_size
+from ping_simulator import PingSimulator
 
 plt.ion()
 
@@ -24,7 +25,7 @@ array_position = np.array([0, 0.0185, 0.037])
 
 # add some noise to the signal. We can't anticipate what the tank will sound
 # like in the background, so this is a coarse approximation of background
-# interference
+# interference. Sound card full scale is 1
 noise_level = 1e-5  # white noise variance. play around with this number
 
 # generate a range of potential bearings
@@ -39,8 +40,8 @@ def one_ping(rcr_range, rcr_depth, rcr_bearing):
     start_i = 300  # small offset for plotting purposes
 
     # each receiver will have a slighly different coordinates based on bearing and
-    # distance
-    dx = rcr_range + array_position * sin(radians(rcr_bearing))
+    # distance. The source is at rcr_bearing, so elements towards it are closer
+    dx = rcr_range - array_position * sin(radians(rcr_bearing))
     dy = array_position * cos(radians(rcr_bearing))
     rr = np.sqrt(dx ** 2 + dy ** 2)
 
@@ -66,7 +67,7 @@ def one_ping(rcr_range, rcr_depth, rcr_bearing):
                        fill_value=0.)
 
     # create time series as a sum of all arrivals
-    x_sig = np.zeros((num_channels, taxis.size), dtype=np.float_)
+    x_sig = np.zeros((num_channels, taxis.size), dtype=np.float64)
     x_sig += sig_ier(taxis - time_dir[:, None]) / r_dir[:, None]
     x_sig -= sig_ier(taxis - time_surf[:, None]) / r_surf[:, None]
     x_sig -= sig_ier(taxis - time_bottom[:, None]) / r_bottom[:, None]
@@ -77,16 +78,21 @@ def one_ping(rcr_range, rcr_depth, rcr_bearing):
 
 def get_buffer():
     """Get a single buffer, bearing will slowly change with pings"""
-    currdata = []
-    for tb in test_bearings:
-        currdata.append(one_ping(10, 3, tb))
-        all_data = np.concatenate(currdata, axis=1)
-        num_blocks = all_data.shape[1] // nbd.buffer_size
-        block_data = all_data[:, :num_blocks * nbd.buffer_size].copy()
-        block_data = np.split(block_data, num_blocks, axis=1)
-        currdata = [all_data[:, num_blocks * nbd.buffer_size + 1:]]
-        for block in block_data:
-            yield block
+    sim = PingSimulator(fc=fc,
+                        fs=fs,
+                        buffer_size=buffer_size,
+                        array_position=array_position,
+                        bearing=test_bearings,
+                        rcr_range=10,
+                        rcr_depth=3,
+                        source_depth=source_depth,
+                        channel_depth=channel_depth,
+                        c=c,
+                        pulse_width=T,
+                        ping_period=1.,
+                        noise_level=noise_level,
+                        duration=num_b)
+    return sim.buffers()
 
 # start up firware node
 nbd = BeagleFirmware(fc, sim_gen=get_buffer())
@@ -0,0 +1,78 @@
+"""
+Compare audio_data_t to audio_data_v2_t. Reports bytes sent over LCM for one
+buffer of processed data, and the time needed to decode a message into a
+complex numpy array on the receiving side.
+"""
+import numpy as np
+from time import perf_counter
+
+from zoidberg_lcm import audio_data_t, audio_data_v2_t
+from zoidberg import timestamp
+import audio_payload
+import beagle_firmware
+
+num_loops = 500
+
+
+def v1_message(samples):
+    """Encode samples with the original message"""
+    msg = audio_data_t()
+    msg.timestamp = timestamp()
+    msg.num_channels, msg.num_samples = samples.shape
+    msg.fc = 30000
+    msg.num_step = beagle_firmware.num_step
+    msg.fs = beagle_firmware.fs
+    msg.re_samples = samples.real
+    msg.im_samples = samples.imag
+    return msg.encode()
+
+
+def v1_decode(data):
+    """Original decode in AcousticsNode"""
+    msg = audio_data_t.decode(data)
+    return np.array(msg.re_samples) + 1j * np.array(msg.im_samples)
+
+
+def v2_message(samples, encoding):
+    """Encode samples with the version 2 message"""
+    msg = audio_data_v2_t()
+    msg.utime = 0
+    msg.sample_index = 0
+    msg.fc = 30000
+    msg.num_step = beagle_firmware.num_step
+    msg.fs = beagle_firmware.fs
+    audio_payload.encode_samples(msg, samples, encoding)
+    return msg.encode()
+
+
+def v2_decode(data):
+    """Version 2 decode in AcousticsNode"""
+    msg = audio_data_v2_t.decode(data)
+    return audio_payload.decode_samples(msg)
+
+
+def time_per_call(func, data):
+    """Average time of func in micro seconds"""
+    start = perf_counter()
+    for _ in range(num_loops):
+        func(data)
+    return (perf_counter() - start) / num_loops * 1e6
+
+
+if __name__ == "__main__":
+    num_sections = beagle_firmware.num_sections
+    samples = np.random.randn(3, num_sections) \
+            + 1j * np.random.randn(3, num_sections)
+    samples = samples.astype(np.complex64)
+
+    cases = [('audio_data_t', v1_message(samples), v1_decode),
+             ('v2 complex64', v2_message(samples, audio_payload.COMPLEX64),
+              v2_decode),
+             ('v2 int16', v2_message(samples, audio_payload.INT16),
+              v2_decode)]
+
+    for name, data, decode in cases:
+        err = np.max(np.abs(decode(data) - samples))
+        dt = time_per_call(decode, data)
+        print('{:14s} {:6d} bytes {:8.1f} us decode, max error {:.1e}'.format(
+              name, len(data), dt, err))
@@ -0,0 +1,95 @@
+"""
+Run BeagleFirmware callback capture against a fake PyAudio stream. The fake
+stream calls the stream callback from its own thread at the sound card rate,
+with int24 buffers of simulated pings. Processing is slowed down by a hiccup
+every few buffers, and the capture counters show whether the ring absorbed it.
+"""
+import numpy as np
+import threading
+from time import sleep, perf_counter
+
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+from ping_simulator import PingSimulator
+
+fc = 30000
+run_time = 5.  # length of fake stream, (s)
+hiccup_every = 20  # buffers between processing hiccups
+hiccups = [0.05, 0.2, 0.5, 1.]  # length of processing hiccup, (s)
+
+
+def to_int24(buf):
+    """Interleaved little endian int24 bytes of a float buffer"""
+    ints = np.round(np.clip(buf.T, -1, 1 - 2 ** -23) * 2 ** 23)
+    ints = ints.astype('<i4').reshape(-1, 1).view(np.uint8)
+    return ints[:, :3].tobytes()
+
+
+class FakeStream:
+    """Calls a stream callback at the sampling rate, like a PyAudio stream"""
+    def __init__(self, callback, buffers, rate, frames_per_buffer):
+        self.callback = callback
+        self.buffers = buffers
+        self.period = frames_per_buffer / rate
+        self.frames_per_buffer = frames_per_buffer
+        self.is_active = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.start()
+
+    def _run(self):
+        start = perf_counter()
+        for i, buf in enumerate(self.buffers):
+            if not self.is_active:
+                return
+            # wait for the sound card to fill the next buffer
+            wait = start + (i + 1) * self.period - perf_counter()
+            if wait > 0:
+                sleep(wait)
+            self.callback(buf, self.frames_per_buffer, {}, 0)
+
+    def stop_stream(self):
+        self.is_active = False
+        self.thread.join()
+
+    def close(self):
+        pass
+
+
+class FakeAudio:
+    """Replaces pyaudio.PyAudio, open returns a FakeStream"""
+    def __init__(self, buffers):
+        self.buffers = buffers
+
+    def open(self, rate, frames_per_buffer, stream_callback, **kwargs):
+        return FakeStream(stream_callback, self.buffers, rate,
+                          frames_per_buffer)
+
+    def terminate(self):
+        pass
+
+
+if __name__ == "__main__":
+    sim = PingSimulator(fc=fc, fs=beagle_firmware.fs,
+                        buffer_size=beagle_firmware.buffer_size,
+                        duration=run_time, ping_period=0.5, seed=0)
+    raw = [to_int24(b) for b in sim.buffers()]
+
+    for hiccup in hiccups:
+        bf = BeagleFirmware(fc, capture='callback', audio=FakeAudio(raw))
+        process = bf.process
+        num_calls = [0]
+
+        def slow_process(recorded_data):
+            """Process with a periodic stall"""
+            num_calls[0] += 1
+            if num_calls[0] % hiccup_every == 0:
+                sleep(hiccup)
+            return process(recorded_data)
+        bf.process = slow_process
+
+        bf.isactive(True)
+        sleep(run_time + 0.5)
+        bf.isactive(False)
+        stats = bf.capture_stats()
+        print('hiccup {:.2f} s: '.format(hiccup)
+              + ', '.join('{} {}'.format(k, v) for k, v in stats.items()))
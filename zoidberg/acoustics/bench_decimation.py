@@ -0,0 +1,69 @@
+"""
+Measure the LCM bandwidth and CPU cost of baseband decimation. Simulated pings
+are processed by BeagleFirmware at each decimation factor, and every message is
+handled by an AcousticsNode. Reports bytes per second sent from the beaglebone,
+firmware time per buffer, node decode and handling time per second of data,
+and the arrival time and bearing of each detected ping.
+"""
+import numpy as np
+from time import perf_counter
+
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+from acoustics_node import AcousticsNode
+from ping_simulator import PingSimulator
+from zoidberg_lcm import audio_data_v2_t
+import audio_payload
+
+fc = 30000
+factors = [1, 2, 4, 8]
+duration = 10.  # length of simulation, (s)
+ping_period = 1.
+first_ping = 0.75
+rcr_bearing = 30.
+
+
+if __name__ == "__main__":
+    sim = PingSimulator(fc=fc, fs=beagle_firmware.fs,
+                        buffer_size=beagle_firmware.buffer_size,
+                        bearing=rcr_bearing, ping_period=ping_period,
+                        first_ping=first_ping, noise_level=1e-4,
+                        duration=duration, seed=0)
+    buffers = list(sim.buffers())
+    tail_start = beagle_firmware.tail_i[0] - beagle_firmware.buffer_size
+
+    print('factor      bytes/s   firmware us/buffer   decode us/s   '
+          'node us/s   detections')
+    for factor in factors:
+        bf = BeagleFirmware(fc, decimation=factor)
+        an = AcousticsNode(fc)
+
+        messages = []
+        start = perf_counter()
+        for i, recorded_data in enumerate(buffers):
+            processed_data = bf.process(recorded_data)
+            utime = int(round((i * bf.buffer_size + tail_start)
+                              / bf.fs * 1e6))
+            messages += bf.encode(processed_data, utime)
+        t_firmware = (perf_counter() - start) / len(buffers) * 1e6
+
+        start = perf_counter()
+        for data in messages:
+            audio_payload.decode_samples(audio_data_v2_t.decode(data))
+        t_decode = (perf_counter() - start) / duration * 1e6
+
+        detections = []
+        start = perf_counter()
+        for data in messages:
+            last_arrival = an.arrival_time
+            an.handle_message(data)
+            if an.arrival_time != last_arrival:
+                detections.append('{:.4f} s {:.1f} deg'.format(
+                                  an.arrival_time, np.degrees(an.bearing)))
+        t_node = (perf_counter() - start) / duration * 1e6
+
+        num_bytes = sum(len(data) for data in messages) / duration
+        print('{:6d} {:12.0f} {:20.1f} {:13.1f} {:11.1f}   {:d}'.format(
+              factor, num_bytes, t_firmware, t_decode, t_node,
+              len(detections)))
+        print('       ' + ', '.join(detections[:3]))
@@ -0,0 +1,68 @@
+"""
+Compare continuous and event transmission from the beaglebone. Simulated pings
+are processed by BeagleFirmware in each mode, and every message is handled by
+an AcousticsNode. Reports bytes per second sent over LCM, including noise
+summaries, node handling time per second of data, and the arrival time and
+bearing of each detected ping.
+"""
+import numpy as np
+from time import perf_counter
+
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+from acoustics_node import AcousticsNode
+from ping_simulator import PingSimulator
+
+fc = 30000
+modes = [('continuous', 1), ('event', 1), ('continuous', 4), ('event', 4)]
+duration = 10.  # length of simulation, (s)
+ping_period = 1.
+first_ping = 0.75
+rcr_bearing = 30.
+
+
+if __name__ == "__main__":
+    sim = PingSimulator(fc=fc, fs=beagle_firmware.fs,
+                        buffer_size=beagle_firmware.buffer_size,
+                        bearing=rcr_bearing, ping_period=ping_period,
+                        first_ping=first_ping, noise_level=1e-4,
+                        duration=duration, seed=0)
+    buffers = list(sim.buffers())
+    tail_start = beagle_firmware.tail_i[0] - beagle_firmware.buffer_size
+
+    print('transmit    factor      bytes/s   node us/s   detections   '
+          'bearing error (deg)')
+    for transmit, factor in modes:
+        bf = BeagleFirmware(fc, decimation=factor, transmit=transmit)
+        an = AcousticsNode(fc)
+
+        messages = []
+        statuses = []
+        for i, recorded_data in enumerate(buffers):
+            processed_data = bf.process(recorded_data)
+            utime = int(round((i * bf.buffer_size + tail_start)
+                              / bf.fs * 1e6))
+            messages += bf.encode(processed_data, utime)
+            statuses += bf.encode_status(utime)
+
+        arrivals = []
+        bearings = []
+        start = perf_counter()
+        for data in messages:
+            last_arrival = an.arrival_time
+            an.handle_message(data)
+            if an.arrival_time != last_arrival:
+                arrivals.append(an.arrival_time)
+                bearings.append(np.degrees(an.bearing))
+        for data in statuses:
+            an.handle_status(data)
+        t_node = (perf_counter() - start) / duration * 1e6
+
+        num_bytes = sum(len(data) for data in messages + statuses) / duration
+        error = np.abs(np.array(bearings) - rcr_bearing)
+        print('{:10s} {:7d} {:12.0f} {:11.1f} {:12d}   {:.2f} mean {:.2f} max'
+              .format(transmit, factor, num_bytes, t_node, len(arrivals),
+                      np.mean(error) if error.size else np.nan,
+                      np.max(error) if error.size else np.nan))
+        print('           ' + ', '.join('{:.4f} s'.format(t)
+                                        for t in arrivals[:4]))
@@ -0,0 +1,55 @@
+"""
+Compare Int24Decoder to the original BeagleFirmware._buf_to_np. The original
+function scaled the up-cast int32 by 2 ** -23, so its output is 256 times the
+-1, 1 range used by the decoder. It also returned (samples, channels), which
+needed another transpose before process.
+"""
+import numpy as np
+from time import perf_counter
+
+from int24_decoder import Int24Decoder
+
+num_channels = 3
+buffer_size = 2 ** 12
+num_loops = 2000
+
+
+def buf_to_np(buf, num_bytes=3, num_channels=num_channels):
+    """Original conversion of a buffer of bytes to numpy array"""
+    int_to_float = 1 / 2 ** (8 * num_bytes - 1)
+    a = np.ndarray(len(buf), np.dtype('<i1'), buf)
+    e = np.zeros(int(len(buf) // num_bytes), np.dtype('<i4'))
+    for i in range(num_bytes):
+        # e is offset by 1, this makes LSB 0 (up-casting data type)
+        e.view(dtype='<i1')[i + 1::4] = a.view(dtype='<i1')[i::3]
+    result = np.array(e, dtype='float32') * int_to_float
+    return result.reshape(-1, num_channels)
+
+
+def time_per_call(func, buf):
+    """Average time of func in micro seconds"""
+    start = perf_counter()
+    for _ in range(num_loops):
+        func(buf)
+    return (perf_counter() - start) / num_loops * 1e6
+
+
+if __name__ == "__main__":
+    decoder = Int24Decoder(num_channels, buffer_size)
+    buf = np.random.randint(0, 256, size=buffer_size * num_channels * 3,
+                            dtype=np.uint8).tobytes()
+
+    expected = buf_to_np(buf).T / 256
+    result = decoder.decode(buf)
+    print('max absolute difference: {:.3e}'.format(
+        np.max(np.abs(expected - result))))
+
+    # original function followed by the transpose needed by process
+    t_orig = time_per_call(lambda b: np.ascontiguousarray(buf_to_np(b).T),
+                           buf)
+    t_new = time_per_call(decoder.decode, buf)
+    out = np.zeros((num_channels, buffer_size), dtype=np.float32)
+    t_out = time_per_call(lambda b: decoder.decode(b, out=out), buf)
+    print('original:          {:8.1f} us / buffer'.format(t_orig))
+    print('decoder:           {:8.1f} us / buffer'.format(t_new))
+    print('decoder, out=:     {:8.1f} us / buffer'.format(t_out))
@@ -0,0 +1,87 @@
+"""
+Compare the sliding DFT in BeagleFirmware.process to the original dense
+filter matrix implementation. Checks that both produce the same result, then
+reports buffers processed per second. Real time is fs / buffer_size buffers
+per second, about 23.4 at 96 kHz.
+"""
+import numpy as np
+from time import perf_counter
+
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+
+num_buffers = 200
+
+
+class DenseFilter:
+    """Original implementation, a dense matrix multiply for each buffer"""
+    def __init__(self, bf):
+        """Build filter matrices from a BeagleFirmware instance"""
+        buffer_size = bf.buffer_size
+        main_i = beagle_firmware.main_i
+        tail_i = beagle_firmware.tail_i
+
+        # main filter is a large matrix that processes all data with no overlap
+        main_filter = []
+        for mi in main_i:
+            temp = np.zeros(buffer_size, dtype=np.complex64)
+            temp[mi: mi + bf.winwidth] = bf.twidle.copy()
+            main_filter.append(temp)
+        self.main_filter = np.array(main_filter).T
+
+        # tail filter is a small matrix that processes data that is overlaped
+        self.old_tail_size = buffer_size - tail_i[0]
+        self.new_tail_size = bf.winwidth
+        tail_filter = []
+        for mi in tail_i - tail_i[0]:
+            temp = np.zeros(self.old_tail_size + bf.winwidth,
+                            dtype=np.complex64)
+            temp[mi: mi + bf.winwidth] = bf.twidle.copy()
+            tail_filter.append(temp)
+        self.tail_filter = np.array(tail_filter).T
+
+        self.old_tail = np.zeros((bf.num_channels, self.old_tail_size),
+                                 dtype=np.float32)
+
+    def process(self, recorded_data):
+        """Compute single frequency samples from a recorded time series"""
+        all_tail = np.concatenate([self.old_tail,
+                                   recorded_data[:, :self.new_tail_size]],
+                                   axis=1)
+        tail_atfc = all_tail @ self.tail_filter
+        main_atfc = recorded_data @ self.main_filter
+        self.old_tail = recorded_data[:, -self.old_tail_size:].copy()
+        return np.concatenate([tail_atfc, main_atfc], axis=1)
+
+
+def buffers_per_second(process, buffers):
+    """Time process over all buffers"""
+    start = perf_counter()
+    for buf in buffers:
+        process(buf)
+    return len(buffers) / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    fc = 30000
+    bf = BeagleFirmware(fc)
+    dense = DenseFilter(bf)
+
+    buffers = np.random.randn(num_buffers, bf.num_channels, bf.buffer_size)
+    buffers = buffers.astype(np.float32)
+
+    # check both implementations agree
+    ref = BeagleFirmware(fc)
+    max_err = 0
+    for buf in buffers[:10]:
+        expected = dense.process(buf)
+        result = ref.process(buf)
+        max_err = max(max_err, np.max(np.abs(expected - result)))
+    print('max absolute difference: {:.3e}'.format(max_err))
+
+    real_time = bf.fs / bf.buffer_size
+    dense_rate = buffers_per_second(dense.process, buffers)
+    sliding_rate = buffers_per_second(bf.process, buffers)
+    print('real time:   {:8.1f} buffers / s'.format(real_time))
+    print('dense:       {:8.1f} buffers / s'.format(dense_rate))
+    print('sliding DFT: {:8.1f} buffers / s'.format(sliding_rate))
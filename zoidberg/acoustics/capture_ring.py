@@ -0,0 +1,71 @@
+"""
+============
+Capture ring
+============
+Preallocated ring of raw sound card buffers, handed from the PyAudio stream
+callback to a processing thread. There is a single producer and a single
+consumer, each of which only advances its own counter, so no lock is needed.
+A slot is published by advancing num_written after its data is copied, and
+freed by advancing num_read after the consumer is done with it.
+
+When the ring is full, the newest buffer is dropped and counted as an overrun,
+the consumer never has a slot overwritten while it is in use.
+"""
+import numpy as np
+
+
+class CaptureRing:
+    """Single producer, single consumer ring of raw buffers"""
+    def __init__(self, num_buffers, bytes_per_buffer):
+        """num_buffers is the number of slots, each of bytes_per_buffer"""
+        self.num_buffers = num_buffers
+        self.bytes_per_buffer = bytes_per_buffer
+        self.data = np.zeros((num_buffers, bytes_per_buffer), dtype=np.uint8)
+        # sound card frame counter and epoch time of each slot, (us)
+        self.frame_index = np.zeros(num_buffers, dtype=np.int64)
+        self.utime = np.zeros(num_buffers, dtype=np.int64)
+
+        # only written by the producer
+        self.num_written = 0
+        self.num_overruns = 0
+        self.high_water = 0  # largest number of waiting buffers
+        # only written by the consumer
+        self.num_read = 0
+
+    @property
+    def depth(self):
+        """Number of buffers waiting for the consumer"""
+        return self.num_written - self.num_read
+
+    def put(self, buf, frame_index, utime):
+        """Copy one raw buffer into the ring, called by the producer
+        returns False if the ring is full and the buffer was dropped
+        """
+        depth = self.num_written - self.num_read
+        if depth >= self.num_buffers:
+            self.num_overruns += 1
+            return False
+        slot = self.num_written % self.num_buffers
+        self.data[slot] = np.frombuffer(buf, dtype=np.uint8)
+        self.frame_index[slot] = frame_index
+        self.utime[slot] = utime
+        # publish slot only after it is complete
+        self.num_written += 1
+        self.high_water = max(self.high_water, depth + 1)
+        return True
+
+    def get(self):
+        """Oldest waiting buffer, called by the consumer
+        returns (data, frame_index, utime), or None if the ring is empty. data
+        is a view of the slot, which is valid until release is called
+        """
+        if self.num_read == self.num_written:
+            return None
+        slot = self.num_read % self.num_buffers
+        return (self.data[slot],
+                int(self.frame_index[slot]),
+                int(self.utime[slot]))
+
+    def release(self):
+        """Free the slot returned by get"""
+        self.num_read += 1
@@ -0,0 +1,92 @@
+"""
+====
+CFAR
+====
+Cell-averaging constant false alarm rate (CA-CFAR) detector. The noise power
+of each channel is the mean power of the num_ref samples before the sample
+under test, leaving num_guard samples between them so the start of a ping does
+not raise its own threshold. A sample is detected when its power exceeds the
+noise power by a factor set from the false alarm rate.
+
+Samples are given in the order they are received, one message at a time. The
+last samples of each message are kept, so that the reference window runs
+across message boundaries. After a gap the detector is reset, and can be
+started again from saved samples with update. Window sums are differences of a
+cumulative sum, which costs the same for every sample however long the window
+is.
+"""
+import numpy as np
+
+
+class CfarDetector:
+    """Lagging window CA-CFAR, with running statistics for each channel"""
+    def __init__(self, num_channels, pfa=1e-6, num_ref=64, num_guard=4):
+        """pfa is the probability of false alarm of one sample on one channel
+        num_ref is the number of noise reference samples
+        num_guard is the number of samples skipped before the sample under test
+        """
+        self.num_channels = num_channels
+        self.pfa = pfa
+        self.num_ref = num_ref
+        self.num_guard = num_guard
+        self.reset()
+
+    @property
+    def scale(self):
+        """Ratio of detection threshold to mean noise power. Power of complex
+        gaussian noise is exponential, this sets the false alarm rate of a
+        full reference window to pfa
+        """
+        return self.num_ref * (self.pfa ** (-1 / self.num_ref) - 1)
+
+    def reset(self):
+        """Forget noise statistics, for example after missing data"""
+        self._history = np.zeros((self.num_channels, 0))
+
+    @property
+    def noise(self):
+        """Mean power of each channel over the saved samples, or None"""
+        if self._history.shape[1] == 0:
+            return None
+        return np.mean(self._history, axis=1)
+
+    def update(self, samples):
+        """Add samples to the noise statistics without detection, for example
+        to start again after samples that were not searched. Only the end of
+        the samples is used.
+        """
+        num_keep = self.num_ref + self.num_guard
+        samples = samples[:, -num_keep:]
+        power = samples.real ** 2 + samples.imag ** 2
+        power = np.concatenate([self._history, power], axis=1)
+        self._history = power[:, -num_keep:]
+
+    def detect(self, samples):
+        """Detection of each new sample, samples have shape (channels, N)
+        returns a boolean array with shape (N,), true where any channel is
+        over its threshold
+        """
+        num_samples = samples.shape[1]
+        power = samples.real ** 2 + samples.imag ** 2
+        power = np.concatenate([self._history, power], axis=1)
+        num_old = self._history.shape[1]
+
+        # cumulative sum with a leading zero, window sum is a difference
+        csum = np.zeros((self.num_channels, power.shape[1] + 1))
+        np.cumsum(power, axis=1, out=csum[:, 1:])
+
+        # reference window of each new sample, shorter until history fills
+        test_i = num_old + np.arange(num_samples)
+        ref_end = np.maximum(test_i - self.num_guard, 0)
+        ref_start = np.maximum(ref_end - self.num_ref, 0)
+        num_cells = ref_end - ref_start
+        noise = (csum[:, ref_end] - csum[:, ref_start]) \
+              / np.maximum(num_cells, 1)
+
+        is_over = power[:, num_old:] > self.scale * noise
+        # no decision until there is a full reference window
+        is_over[:, num_cells < self.num_ref] = False
+
+        # keep enough samples for the next reference windows
+        self._history = power[:, -(self.num_ref + self.num_guard):]
+        return np.any(is_over, axis=0)
@@ -0,0 +1,89 @@
+"""
+Compare bartlett, mvdr and music bearing estimates on simulated pings at a
+range of noise levels. Each ping is processed by BeagleFirmware, snapshots are
+taken at the first threshold crossing, and all pings at a noise level are
+beamformed as one batch.
+
+The broadband GCC-PHAT estimate uses a window of raw data starting at the same
+crossing. Its time includes the FFTs of the raw windows, while the narrowband
+times only include beamforming of the cross-spectral matrices.
+"""
+import numpy as np
+from time import perf_counter
+
+import bearing_simulation
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+from acoustics_node import AcousticsNode
+from beamformer import Beamformer, methods
+from gcc_phat import GccPhat
+
+# white noise variance, sound card full scale is 1
+noise_levels = [1e-6, 1e-5, 1e-4, 1e-3]
+num_trials = 50
+rcr_range = 10
+rcr_depth = 3
+# number of buffers that contain the direct and reflected arrivals
+num_buffers = 2
+# half width of the GCC-PHAT frequency band, (Hz)
+gcc_band = 2000.
+
+
+def section_starts(bf):
+    """Raw sample index of each section in the first num_buffers buffers"""
+    starts = [np.hstack([(i - 1) * bf.buffer_size + beagle_firmware.tail_i,
+                         i * bf.buffer_size + beagle_firmware.main_i])
+              for i in range(num_buffers)]
+    return np.hstack(starts)
+
+
+def ping_snapshots(bf, an, gcc, rcr_bearing):
+    """Snapshots and raw window at the start of one simulated ping"""
+    x_sig = bearing_simulation.one_ping(rcr_range, rcr_depth, rcr_bearing)
+    bf.dft.reset()
+    p_atfc = [bf.process(x_sig[:, i * bf.buffer_size: (i + 1) * bf.buffer_size])
+              for i in range(num_buffers)]
+    p_atfc = np.concatenate(p_atfc, axis=1)
+    # first crossing of half of the peak amplitude
+    amp = np.abs(p_atfc[0])
+    fei = np.argmax(amp > np.max(amp) / 2)
+    start = max(section_starts(bf)[fei], 0)
+    raw = x_sig[:, start: start + gcc.window_size]
+    return p_atfc[:, fei: fei + an.num_snapshots], raw
+
+
+if __name__ == "__main__":
+    fc = bearing_simulation.fc
+    bf = BeagleFirmware(fc)
+    an = AcousticsNode(fc)
+    beamformers = [Beamformer(an.geometry, fc, an.c, method=m)
+                   for m in methods]
+    gcc = GccPhat(an.geometry, bf.fs, an.c,
+                  band=(fc - gcc_band, fc + gcc_band))
+
+    names = methods + ('gcc_phat',)
+    print('noise level   ' + ''.join(['{:>20s}'.format(m) for m in names]))
+    for noise in noise_levels:
+        bearing_simulation.noise_level = noise
+        true_bearing = np.random.uniform(-80, 80, num_trials)
+        pings = [ping_snapshots(bf, an, gcc, b) for b in true_bearing]
+        beams = np.array([p[0] for p in pings])
+        raw = np.array([p[1] for p in pings])
+        K = an.beamformer.cross_spectral(beams)
+
+        results = []
+        for beamformer in beamformers:
+            start = perf_counter()
+            bearing, _, _, _ = beamformer.beamform(K)
+            dt = (perf_counter() - start) / num_trials * 1e6
+            err = np.degrees(bearing) - true_bearing
+            rms = np.sqrt(np.mean(err ** 2))
+            results.append('{:8.2f} deg {:5.1f} us'.format(rms, dt))
+
+        start = perf_counter()
+        bearing, _ = gcc.bearing(raw)
+        dt = (perf_counter() - start) / num_trials * 1e6
+        err = np.degrees(bearing) - true_bearing
+        rms = np.sqrt(np.mean(err ** 2))
+        results.append('{:8.2f} deg {:5.1f} us'.format(rms, dt))
+        print('{:11.0e}   '.format(noise) + ''.join(results))
@@ -0,0 +1,132 @@
+"""
+=========
+Decimator
+=========
+Complex baseband, low-pass filter and decimate the output of the sliding DFT.
+Each DFT section is referenced to the start of its own window, so a steady tone
+at fc has a phase that advances by 2 pi fc / fs per sample of section start.
+Multiplying each section by exp(-j 2 pi fc s / fs), where s is the absolute
+sample of the section start, removes this rotation and leaves a slowly varying
+baseband signal. The same factor is applied to every channel, so the phase
+difference between channels used in beamforming is unchanged.
+
+The baseband signal is low-pass filtered with a Hann window FIR, and only
+every factor-th output is computed. Filter state is kept between buffers. The
+filter delays its output by half its length, this delay is returned with each
+buffer so that time stamps refer to the center of the filter. A sinc filter
+has a sharper cutoff, but its ringing starts before the center of the filter,
+which a sensitive detector finds as an early arrival. All Hann taps are
+positive, so a ping is at most factor sections early.
+
+The pass band is fs / (num_step * factor) / 2 wide, pingers that are off fc by
+more than this are attenuated.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class BasebandDecimator:
+    """Baseband decimation of sliding DFT sections"""
+    def __init__(self, fcs, fs, section_offsets, buffer_size, num_channels,
+                 factor, num_taps=None):
+        """fcs is a list of integer bin frequencies, fs is the sampling rate
+        section_offsets is the start of each DFT output section relative to
+        the start of its buffer, in output order
+        factor is the decimation factor, num_taps is the FIR filter length
+        """
+        self.fcs = np.asarray(fcs, dtype=np.int64)
+        self.fs = int(fs)
+        self.buffer_size = buffer_size
+        self.num_channels = num_channels
+        self.factor = factor
+        self.section_offsets = np.asarray(section_offsets, dtype=np.int64)
+        self.num_sections = self.section_offsets.size
+        self.num_bins = self.fcs.size
+
+        # demodulation of each section of a buffer, buffer phase is separate
+        self._section_phase = np.exp(-2j * np.pi * self.fcs[None, :]
+                                     * self.section_offsets[:, None]
+                                     / self.fs).astype(np.complex64)
+
+        # low-pass filter, first zero at the new sampling frequency
+        if num_taps is None:
+            num_taps = 2 * factor - 1
+        self.num_taps = num_taps
+        taps = np.hanning(num_taps + 2)[1: -1]
+        taps /= np.sum(taps)
+        # taps are applied to windows in time order
+        self.taps = taps[::-1].astype(np.float32).copy()
+        # delay of filter output, (sections)
+        self.delay = (num_taps - 1) / 2
+
+        # filter state followed by the current buffer, real and imaginary
+        # parts are interleaved on the last axis
+        self.num_state = num_taps - 1
+        self.stream = np.zeros((num_channels,
+                                self.num_state + self.num_sections,
+                                2 * self.num_bins), dtype=np.float32)
+        s_ch, s_i, s_b = self.stream.strides
+        # window k ends at section k of the current buffer
+        num_windows = self.num_sections
+        self._windows = as_strided(self.stream,
+                                   shape=(num_channels, num_windows,
+                                          2 * self.num_bins, num_taps),
+                                   strides=(s_ch, s_i, s_b, s_i),
+                                   writeable=False)
+        self.reset()
+
+    def reset(self):
+        """Clear filter state and restart the sample count"""
+        self.stream[:] = 0
+        self.buffer_count = 0
+        # number of sections until the next output
+        self._next_out = 0
+
+    def skip(self, num_buffers):
+        """Advance over missing buffers, filter state is cleared
+        returns the number of output samples that were skipped
+        """
+        num_in = num_buffers * self.num_sections
+        num_out = 0
+        if num_in > self._next_out:
+            num_out = (num_in - self._next_out - 1) // self.factor + 1
+        self._next_out = (self._next_out - num_in) % self.factor
+        self.buffer_count += num_buffers
+        self.stream[:] = 0
+        return num_out
+
+    def _buffer_phase(self):
+        """Demodulation of the start of the current buffer, computed with
+        integers so that it does not drift
+        """
+        cycles = (self.fcs * self.buffer_count * self.buffer_size) % self.fs
+        return np.exp(-2j * np.pi * cycles / self.fs).astype(np.complex64)
+
+    def process(self, processed_data):
+        """Decimate one buffer of DFT sections
+        processed_data has shape (num_channels, num_sections), or
+        (num_channels, num_sections, num_bins) for a filter bank
+        returns the decimated data with the same number of axes, and the
+        offset of its first sample from the first input section, (sections)
+        """
+        is_bank = processed_data.ndim == 3
+        if not is_bank:
+            processed_data = processed_data[:, :, None]
+        baseband = processed_data * (self._section_phase
+                                     * self._buffer_phase())
+        self.stream[:, self.num_state:] = \
+                baseband.astype(np.complex64).view(np.float32)
+
+        # sections that produce an output
+        out_i = np.arange(self._next_out, self.num_sections, self.factor)
+        result = self._windows[:, out_i] @ self.taps
+        result = np.ascontiguousarray(result).view(np.complex64)
+        offset = (out_i[0] if out_i.size else 0) - self.delay
+
+        # save filter state, and position of next output
+        self.stream[:, :self.num_state] = self.stream[:, -self.num_state:]
+        self._next_out = (self._next_out - self.num_sections) % self.factor
+        self.buffer_count += 1
+        if not is_bank:
+            return result[:, :, 0], offset
+        return result, offset
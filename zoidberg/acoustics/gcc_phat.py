@@ -0,0 +1,150 @@
+"""
+========
+GCC-PHAT
+========
+Broadband bearing estimate from the time difference of arrival (TDOA) between
+hydrophones. The generalized cross-correlation with phase transform whitens
+the cross spectrum of each channel pair, which sharpens the correlation peak of
+the direct arrival compared to later surface and bottom reflections.
+
+All channel pairs are computed with one batched FFT, and the correlations are
+upsampled by zero padding the cross spectrum for sub-sample delays. A pulse
+with a narrow band has a correlation peak every period, which is ambiguous for
+pairs more than half a wavelength apart. Bearing is therefore found from the
+delays of all pairs jointly, by summing the pair correlations at the delays of
+each look direction and refining the best direction with a parabola. The same
+conventions as the beamformer are used, the arrival time at position p is
+earlier by p . u / c for look direction u, which points towards the source.
+"""
+import numpy as np
+import itertools
+from math import pi
+
+
+class GccPhat:
+    """TDOA bearing estimate from short windows of raw data"""
+    def __init__(self, geometry, fs, c, window_size=256, band=None,
+                 upsample=8, azimuths=None, elevations=None):
+        """geometry is an ArrayGeometry, fs is the sampling frequency, c is the
+        speed of sound, window_size is the number of raw samples in a window
+        band is an optional (low, high) frequency range, (Hz). Only these
+        frequencies are used, otherwise the phase transform gives out of band
+        noise as much weight as the pulse
+        upsample is the interpolation factor of the correlations
+        azimuths and elevations are the look directions, with the same defaults
+        as the beamformer at one degree spacing
+        """
+        self.geometry = geometry
+        self.fs = fs
+        self.c = c
+        self.window_size = window_size
+        self.upsample = upsample
+
+        pairs = np.array(list(itertools.combinations(
+                         range(geometry.num_channels), 2)))
+        self.pair_i = pairs[:, 0]
+        self.pair_j = pairs[:, 1]
+        self.num_pairs = pairs.shape[0]
+
+        # zero pad to avoid circular correlation
+        self.nfft = int(2 ** np.ceil(np.log2(2 * window_size)))
+        self.window = np.hanning(window_size)
+        freqs = np.fft.rfftfreq(self.nfft, 1 / fs)
+        self.in_band = np.ones(freqs.size, dtype=bool)
+        if band is not None:
+            self.in_band = (freqs >= band[0]) & (freqs <= band[1])
+
+        # only lags that are physically possible, plus one for interpolation,
+        # in upsampled samples
+        baseline = geometry.positions[self.pair_i] \
+                 - geometry.positions[self.pair_j]
+        max_delay = np.max(np.linalg.norm(baseline, axis=1)) / c
+        self.max_lag = int(np.ceil(max_delay * fs * upsample)) + 1
+        self.lags = np.arange(-self.max_lag, self.max_lag + 1)
+
+        if azimuths is None:
+            if geometry.is_linear:
+                azimuths = np.linspace(-pi / 2, pi / 2, 181)
+            else:
+                azimuths = np.arange(360) * 2 * pi / 360 - pi
+        if elevations is None:
+            if geometry.is_linear:
+                elevations = [0.]
+            else:
+                elevations = np.linspace(-pi / 2, pi / 2, 181)
+        self.azimuths = np.asarray(azimuths, dtype=np.float64)
+        self.elevations = np.asarray(elevations, dtype=np.float64)
+
+        # pair delays of every look direction, (upsampled samples)
+        az, el = np.meshgrid(self.azimuths, self.elevations)
+        u = np.stack([np.sin(az) * np.cos(el),
+                      np.cos(az) * np.cos(el),
+                      np.sin(el)], axis=-1).reshape(-1, 3)
+        # channel i hears a source in direction u (p_i - p_j) . u / c earlier
+        look_lags = -u @ baseline.T / c * fs * upsample + self.max_lag
+        # linear interpolation between neighboring lags
+        self._look_i = np.floor(look_lags).astype(np.int64)
+        self._look_w = look_lags - self._look_i
+        self._pair_index = np.arange(self.num_pairs)
+
+    def correlations(self, raw):
+        """Upsampled GCC-PHAT of every channel pair at lags self.lags
+        raw has shape (..., num_channels, window_size)
+        output has shape (..., num_pairs, num_lags)
+        """
+        spec = np.fft.rfft(raw * self.window, n=self.nfft, axis=-1)
+        cross = spec[..., self.pair_i, :] * np.conj(spec[..., self.pair_j, :])
+        # phase transform
+        cross /= np.maximum(np.abs(cross), np.finfo(np.float64).tiny)
+        cross[..., ~self.in_band] = 0
+        corr = np.fft.irfft(cross, n=self.nfft * self.upsample, axis=-1)
+        # negative lags wrap around to the end of the correlation
+        return np.take(corr, self.lags, axis=-1, mode='wrap')
+
+    @staticmethod
+    def _parabolic(left, center, right):
+        """Offset of the vertex of a parabola through three points"""
+        curve = left - 2 * center + right
+        safe = np.where(curve < 0, curve, -1)
+        delta = np.where(curve < 0, 0.5 * (left - right) / safe, 0.)
+        return np.clip(delta, -0.5, 0.5)
+
+    def delays(self, raw):
+        """Delay of channel i relative to channel j for each pair, (s)
+        raw has shape (..., num_channels, window_size)
+        output has shape (..., num_pairs)
+        """
+        corr = self.correlations(raw)
+        peak_i = np.argmax(corr[..., 1:-1], axis=-1)[..., None] + 1
+        neighbors = [np.take_along_axis(corr, peak_i + k, axis=-1)[..., 0]
+                     for k in (-1, 0, 1)]
+        lag = self.lags[peak_i[..., 0]] + self._parabolic(*neighbors)
+        return lag / (self.fs * self.upsample)
+
+    def bearing(self, raw):
+        """Azimuth and elevation estimate from raw data windows, (rad)
+        raw has shape (..., num_channels, window_size)
+        """
+        corr = self.correlations(raw)
+        # summed pair correlation at the delays of each look direction
+        lower = corr[..., self._pair_index, self._look_i]
+        upper = corr[..., self._pair_index, self._look_i + 1]
+        power = np.sum(lower + self._look_w * (upper - lower), axis=-1)
+
+        batch = power.shape[:-1]
+        power = power.reshape(-1, self.elevations.size, self.azimuths.size)
+        peak = np.argmax(power.reshape(power.shape[0], -1), axis=-1)
+        el_i, az_i = np.unravel_index(peak, power.shape[1:])
+        rows = np.arange(power.shape[0])
+
+        azimuth = self.azimuths[az_i]
+        if self.azimuths.size > 2:
+            left = power[rows, el_i, np.maximum(az_i - 1, 0)]
+            right = power[rows, el_i, np.minimum(az_i + 1,
+                                                 self.azimuths.size - 1)]
+            interior = (az_i > 0) & (az_i < self.azimuths.size - 1)
+            delta = self._parabolic(left, power[rows, el_i, az_i], right)
+            azimuth = azimuth + np.where(interior, delta, 0.) \
+                * (self.azimuths[1] - self.azimuths[0])
+        elevation = self.elevations[el_i]
+        return azimuth.reshape(batch), elevation.reshape(batch)
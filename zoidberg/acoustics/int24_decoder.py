@@ -0,0 +1,59 @@
+"""
+=============
+Int24 decoder
+=============
+Convert interleaved little endian int24 sound card buffers to float32 arrays.
+All work arrays are allocated once. Each int24 sample is read as an int32 whose
+lowest byte belongs to the previous sample, so the conversion is a single byte
+copy, a mask of the lowest byte and a transposing cast.
+"""
+import numpy as np
+
+
+class Int24Decoder:
+    """Reusable int24 to float32 conversion"""
+    def __init__(self, num_channels, buffer_size):
+        """num_channels is the number of interleaved channels
+        buffer_size is the number of frames in each buffer
+        """
+        self.num_channels = num_channels
+        self.buffer_size = buffer_size
+        self.num_bytes = 3
+        self.num_samples = num_channels * buffer_size
+
+        # Convert values to -1, 1 range. The int24 is placed in the upper three
+        # bytes of an int32, so full scale is the int32 range
+        self.int_to_float = np.float32(1 / 2 ** 31)
+
+        # raw bytes are copied after a leading zero byte
+        self._raw = np.zeros(self.num_samples * self.num_bytes + 1,
+                             dtype=np.uint8)
+        # overlapping int32 view, a new sample starts every 3 bytes
+        self._raw_int = np.ndarray(shape=(self.num_samples,),
+                                   dtype='<i4',
+                                   buffer=self._raw,
+                                   offset=0,
+                                   strides=(self.num_bytes,))
+        # int32 work array, LSB of each sample is always 0
+        self._work = np.zeros(self.num_samples, dtype='<i4')
+        # samples are interleaved by frame, channels are the fast axis
+        self._work_frames = self._work.reshape(buffer_size, num_channels)
+
+        # default output, shape (num_channels, buffer_size)
+        self.out = np.zeros((num_channels, buffer_size), dtype=np.float32)
+
+    def decode(self, buf, out=None):
+        """Convert a buffer of bytes to numpy array
+        in: N channel int24 buffer
+        out: float32 numpy array, shape (num_channels, buffer_size)
+        If out is not specified, the same array is returned for each call.
+        """
+        if out is None:
+            out = self.out
+        self._raw[1:] = np.frombuffer(buf, dtype=np.uint8)
+        # clear byte from previous sample, this makes LSB 0 (up-casting)
+        np.bitwise_and(self._raw_int, -256, out=self._work)
+        # transpose to (channels, samples) while casting to float
+        np.copyto(out, self._work_frames.T, casting='unsafe')
+        np.multiply(out, self.int_to_float, out=out)
+        return out
@@ -0,0 +1,216 @@
+"""
+===========
+Monte Carlo
+===========
+Batch evaluation of ping detection and bearing accuracy. Every combination of
+noise level, range, depth and bearing is simulated num_trials times with
+PingSimulator. Each trial is pushed through BeagleFirmware.process, encoded as
+audio_data_v2_t and handled by an AcousticsNode, just as on the robot. Trials
+are spread across a process pool.
+
+Results are returned as a numpy structured array with one row per trial, and
+summarized with one row per configuration. Noise levels are white noise
+variance, with a sound card full scale of 1. For example, to compare a fixed
+detection threshold, here a tone 26 dB below full scale, with the default CFAR
+detector
+
+    results = run(sweep, node_params=dict(detection='threshold', threshold=2.))
+    print_summary(summarize(results))
+
+Bearing is estimated by the node's narrowband beamformer, or with bearing_mode
+'gcc_phat' from a window of raw data at each detected arrival time.
+"""
+import numpy as np
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import beagle_firmware
+from beagle_firmware import BeagleFirmware
+from acoustics_node import AcousticsNode
+from ping_simulator import PingSimulator
+from gcc_phat import GccPhat
+
+fc = 30000
+c = 1480.
+ping_period = 1.  # time between pings, (s)
+first_ping = 0.25  # time of first ping in each trial, (s)
+num_pings = 3  # number of pings in each trial
+match_window = 0.01  # largest arrival time error of a detection, (s)
+gcc_band = 2000.  # half width of the GCC-PHAT frequency band, (Hz)
+
+bearing_modes = ('narrowband', 'gcc_phat')
+
+# default sweep of simulation parameters
+sweep = dict(noise_level=[1e-5, 1e-4, 1e-3],
+             rcr_range=[5., 10., 20.],
+             rcr_depth=[1., 3.],
+             bearing=[-60., -30., 0., 30., 60.])
+
+sweep_names = ('noise_level', 'rcr_range', 'rcr_depth', 'bearing')
+trial_dtype = [('noise_level', np.float64),
+               ('rcr_range', np.float64),
+               ('rcr_depth', np.float64),
+               ('bearing', np.float64),
+               ('seed', np.int64),
+               ('num_pings', np.int64),
+               ('num_detected', np.int64),
+               ('num_false', np.int64),
+               ('sum_sq_error', np.float64),
+               ('duration', np.float64)]
+
+# each worker process keeps one firmware and GCC-PHAT instance
+_firmware = None
+_gcc = None
+
+
+def run_trial(trial, node_params=None, beam_method='bartlett',
+              bearing_mode='narrowband'):
+    """Simulate one trial, trial is a tuple of sweep values and seed"""
+    global _firmware, _gcc
+    noise_level, rcr_range, rcr_depth, bearing, seed = trial
+    if bearing_mode not in bearing_modes:
+        raise ValueError('Unknown bearing mode {}'.format(bearing_mode))
+    if _firmware is None:
+        _firmware = BeagleFirmware(fc)
+    bf = _firmware
+    bf.reset()
+
+    an = AcousticsNode(fc, beam_method=beam_method)
+    for key, value in (node_params or {}).items():
+        setattr(an, key, value)
+    if bearing_mode == 'gcc_phat' and _gcc is None:
+        _gcc = GccPhat(an.geometry, bf.fs, an.c,
+                       band=(fc - gcc_band, fc + gcc_band))
+
+    duration = first_ping + num_pings * ping_period
+    sim = PingSimulator(fc=fc,
+                        fs=bf.fs,
+                        buffer_size=bf.buffer_size,
+                        bearing=bearing,
+                        rcr_range=rcr_range,
+                        rcr_depth=rcr_depth,
+                        c=c,
+                        ping_period=ping_period,
+                        first_ping=first_ping,
+                        noise_level=noise_level,
+                        duration=duration,
+                        seed=seed)
+
+    # first processed sample starts in the tail of the previous buffer
+    tail_start = beagle_firmware.tail_i[0] - bf.buffer_size
+    detections = []
+    raw_buffers = []
+    for buffer_i, recorded_data in enumerate(sim.buffers()):
+        if bearing_mode == 'gcc_phat':
+            raw_buffers.append(recorded_data)
+        processed_data = bf.process(recorded_data)
+        start = buffer_i * bf.buffer_size + tail_start
+        utime = int(round(start / bf.fs * 1e6))
+        for data in bf.encode(processed_data, utime):
+            last_arrival = an.arrival_time
+            an.handle_message(data)
+            if an.arrival_time != last_arrival:
+                detections.append((an.arrival_time, an.bearing))
+
+    # direct arrival time at the first hydrophone
+    r_dir = np.sqrt(rcr_range ** 2 + (rcr_depth - sim.source_depth) ** 2)
+    true_times = first_ping + np.arange(num_pings) * ping_period + r_dir / c
+    # only count pings that arrive inside the simulation
+    true_times = true_times[true_times < sim.buffer_size * (buffer_i + 1)
+                            / bf.fs]
+
+    det = np.array(detections).reshape(-1, 2)
+    if bearing_mode == 'gcc_phat' and det.size:
+        # raw window at each detected arrival, all beamformed in one batch
+        raw = np.concatenate(raw_buffers, axis=1)
+        raw = np.pad(raw, ((0, 0), (0, _gcc.window_size)), mode='constant')
+        starts = np.clip(np.round(det[:, 0] * bf.fs).astype(np.int64), 0,
+                         raw.shape[1] - _gcc.window_size)
+        windows = np.stack([raw[:, s: s + _gcc.window_size] for s in starts])
+        det[:, 1], _ = _gcc.bearing(windows)
+
+    # match each detection to the closest ping
+    is_hit = np.zeros(det.shape[0], dtype=bool)
+    num_detected = 0
+    if det.size and true_times.size:
+        dt = np.abs(det[:, 0][:, None] - true_times[None, :])
+        is_hit = np.min(dt, axis=1) < match_window
+        num_detected = np.unique(np.argmin(dt, axis=1)[is_hit]).size
+    err = np.degrees(det[is_hit, 1]) - bearing
+
+    return (noise_level, rcr_range, rcr_depth, bearing, seed,
+            true_times.size, num_detected, np.sum(~is_hit),
+            np.sum(err ** 2), duration)
+
+
+def run(sweep=sweep, num_trials=10, node_params=None, beam_method='bartlett',
+        bearing_mode='narrowband', max_workers=None, seed=0):
+    """Run all trials of a parameter sweep on a process pool
+    sweep is a dict of lists, with keys noise_level, rcr_range, rcr_depth and
+    bearing
+    node_params are AcousticsNode attributes set for every trial, such as
+    detection, threshold, num_snapshots or dead_time
+    bearing_mode is narrowband or gcc_phat
+    returns a structured array with one row per trial
+    """
+    configs = list(itertools.product(*[sweep[n] for n in sweep_names]))
+    trials = [config + (seed + i,)
+              for i, config in enumerate(configs * num_trials)]
+
+    func = partial(run_trial, node_params=node_params,
+                   beam_method=beam_method, bearing_mode=bearing_mode)
+    chunksize = max(1, len(trials) // (8 * (max_workers or 8)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(func, trials, chunksize=chunksize))
+    return np.array(results, dtype=trial_dtype)
+
+
+def summarize(results):
+    """Detection rate, false alarm rate and rms bearing error of each
+    configuration in the output of run
+    """
+    configs = np.stack([results[n] for n in sweep_names], axis=1)
+    unique, inverse = np.unique(configs, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    def total(field):
+        return np.bincount(inverse, weights=results[field],
+                           minlength=unique.shape[0])
+
+    num_pings = total('num_pings')
+    num_detected = total('num_detected')
+    summary = np.zeros(unique.shape[0],
+                       dtype=[(n, np.float64) for n in sweep_names]
+                       + [('num_trials', np.int64),
+                          ('detection_rate', np.float64),
+                          ('false_alarm_rate', np.float64),
+                          ('rms_error', np.float64)])
+    for i, name in enumerate(sweep_names):
+        summary[name] = unique[:, i]
+    summary['num_trials'] = np.bincount(inverse)
+    summary['detection_rate'] = num_detected / np.maximum(num_pings, 1)
+    # false alarms per second
+    summary['false_alarm_rate'] = total('num_false') / total('duration')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['rms_error'] = np.sqrt(total('sum_sq_error') / num_detected)
+    return summary
+
+
+def print_summary(summary):
+    """Print summary as a table"""
+    names = summary.dtype.names
+    print(''.join(['{:>17s}'.format(n) for n in names]))
+    for row in summary:
+        print(''.join(['{:17.4g}'.format(v) for v in row]))
+
+
+if __name__ == "__main__":
+    import sys
+    from time import perf_counter
+    bearing_mode = sys.argv[1] if len(sys.argv) > 1 else 'narrowband'
+    start = perf_counter()
+    results = run(bearing_mode=bearing_mode)
+    print_summary(summarize(results))
+    print('{:d} trials in {:.1f} s'.format(results.size,
+                                          perf_counter() - start))
@@ -0,0 +1,65 @@
+"""
+============
+Ping history
+============
+Fixed capacity record of detected pings, saved in a structured numpy ring
+buffer. Every ping has a sequence index, the number of pings detected before
+it, so a consumer can ask for all pings after the last one it has seen.
+Queries by sequence index or by arrival time return contiguous arrays.
+"""
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+ping_dtype = np.dtype([('index', np.int64),
+                       ('arrival_time', np.float64),
+                       ('bearing', np.float64),
+                       ('elevation', np.float64),
+                       ('power', np.float64)])
+
+
+class PingHistory:
+    """Ring buffer of the latest pings"""
+    def __init__(self, capacity=1024):
+        """capacity is the number of saved pings"""
+        self.capacity = capacity
+        self._ring = RingBuffer(1, capacity, dtype=ping_dtype)
+
+    @property
+    def count(self):
+        """Number of pings added, the index of the next ping"""
+        return self._ring.count
+
+    def add(self, arrival_time, bearing, elevation, power):
+        """Save one ping, returns its record"""
+        ping = np.zeros((1, 1), dtype=ping_dtype)
+        ping['index'] = self._ring.count
+        ping['arrival_time'] = arrival_time
+        ping['bearing'] = bearing
+        ping['elevation'] = elevation
+        ping['power'] = power
+        self._ring.append(ping)
+        return ping[0, 0]
+
+    def saved(self):
+        """All saved pings, oldest first, this is a view"""
+        first = self._ring.first
+        return self._ring.get(first, self._ring.count - first)[0]
+
+    def since(self, index):
+        """Saved pings with sequence index of index or more, this is a view.
+        Pings that are no longer saved are not returned.
+        """
+        start = min(max(index, self._ring.first), self._ring.count)
+        return self._ring.get(start, self._ring.count - start)[0]
+
+    def between(self, start_time, end_time):
+        """Saved pings that arrived from start_time up to end_time, (s)"""
+        pings = self.saved()
+        is_in = (pings['arrival_time'] >= start_time) \
+              & (pings['arrival_time'] < end_time)
+        return pings[is_in]
+
+    def reset(self):
+        """Clear all saved pings"""
+        self._ring.reset()
@@ -0,0 +1,153 @@
+"""
+==============
+Ping simulator
+==============
+Stream simulated hydrophone buffers with periodic pings. Each ping arrives
+along a direct, surface reflected and bottom reflected path, with the same
+geometry as bearing_simulation.one_ping.
+
+Arrivals are placed with a precomputed table of the pulse, shifted by a
+fraction of a sample for each of num_phases fractional delays. Only the
+arrivals that overlap a buffer are added to it, so the cost of each buffer is
+constant however long the simulation runs.
+"""
+import numpy as np
+from math import pi, sin, cos, radians, floor
+
+
+class PingSimulator:
+    """Generator of simulated hydrophone buffers"""
+    def __init__(self, fc=30000, fs=96000, buffer_size=2 ** 12,
+                 array_position=(0, 0.0185, 0.037), bearing=0.,
+                 rcr_range=10., rcr_depth=3., source_depth=4.5,
+                 channel_depth=5., c=1480., pulse_width=0.004,
+                 ping_period=1., first_ping=0., noise_level=1e-5,
+                 duration=None, seed=None, num_phases=64):
+        """fc, fs are the pulse and sampling frequency
+        array_position is the position of each hydrophone along the array, (m)
+        bearing is the ping bearing in degrees. This is either a constant, a
+        sequence with one value for each ping, or a function of ping time
+        rcr_range, rcr_depth are receiver range and depth
+        ping_period is the time between pings, first_ping is the first ping
+        time, (s)
+        noise_level is white noise variance. Sound card full scale is 1, and
+        the direct arrival has an amplitude of 1 / range
+        duration is the length of the simulation, (s), or None for no end
+        seed sets the random noise state
+        num_phases is the number of fractional sample delays of the pulse
+        """
+        self.fc = fc
+        self.fs = fs
+        self.buffer_size = buffer_size
+        self.array_position = np.asarray(array_position, dtype=np.float64)
+        self.num_channels = self.array_position.size
+        self.bearing = bearing
+        self.rcr_range = rcr_range
+        self.rcr_depth = rcr_depth
+        self.source_depth = source_depth
+        self.channel_depth = channel_depth
+        self.c = c
+        self.ping_period = ping_period
+        self.first_ping = first_ping
+        self.noise_level = noise_level
+        self.duration = duration
+        self.rng = np.random.RandomState(seed)
+
+        # pulse table, row p is the pulse delayed by p / num_phases samples
+        self.num_phases = num_phases
+        pulse_size = int(np.ceil(pulse_width * fs))
+        t_win = (pulse_size - 1) / fs
+        self.table_size = pulse_size + 1
+        frac = np.arange(num_phases)[:, None] / num_phases
+        t_pulse = (np.arange(self.table_size)[None, :] - frac) / fs
+        hann = 0.5 - 0.5 * np.cos(2 * pi * t_pulse / t_win)
+        self.pulse_table = np.sin(2 * pi * fc * t_pulse) * hann
+        self.pulse_table[(t_pulse < 0) | (t_pulse > t_win)] = 0
+        self.pulse_table = self.pulse_table.astype(np.float32)
+
+    def ping_bearing(self, ping_i, ping_time):
+        """bearing of a ping in degrees"""
+        if callable(self.bearing):
+            return self.bearing(ping_time)
+        if np.isscalar(self.bearing):
+            return self.bearing
+        return self.bearing[ping_i % len(self.bearing)]
+
+    def arrivals(self, ping_time, rcr_bearing):
+        """arrival sample, pulse phase, channel and amplitude of each path"""
+        # each receiver will have a slighly different coordinates based on
+        # bearing and distance. The source is at rcr_bearing, so elements
+        # towards it are closer
+        b = radians(rcr_bearing)
+        dx = self.rcr_range - self.array_position * sin(b)
+        dy = self.array_position * cos(b)
+        rr2 = dx ** 2 + dy ** 2
+
+        # direct, surface and bottom arrivals
+        r_dir = np.sqrt(rr2 + (self.rcr_depth - self.source_depth) ** 2)
+        r_surf = np.sqrt(rr2 + (self.rcr_depth + self.source_depth) ** 2)
+        r_bottom = np.sqrt(rr2 + (2 * self.channel_depth
+                                  - self.source_depth) ** 2)
+        ranges = np.concatenate([r_dir, r_surf, r_bottom])
+        amps = np.concatenate([1 / r_dir, -1 / r_surf, -1 / r_bottom])
+        channels = np.tile(np.arange(self.num_channels), 3)
+
+        # split arrival time into integer sample and fractional phase
+        start = (ping_time + ranges / self.c) * self.fs
+        start_i = np.floor(start).astype(np.int64)
+        phase = np.round((start - start_i) * self.num_phases).astype(int)
+        # round up to next sample
+        start_i[phase == self.num_phases] += 1
+        phase[phase == self.num_phases] = 0
+        return list(zip(start_i, phase, channels, amps))
+
+    def buffers(self):
+        """Generator of buffers with shape (num_channels, buffer_size)"""
+        num_buffers = None
+        if self.duration is not None:
+            num_buffers = int(floor(self.duration * self.fs
+                                    / self.buffer_size))
+
+        pending = []
+        ping_i = 0
+        buffer_i = 0
+        noise_std = np.sqrt(self.noise_level)
+        while num_buffers is None or buffer_i < num_buffers:
+            b_start = buffer_i * self.buffer_size
+            b_end = b_start + self.buffer_size
+
+            # add arrivals for all pings that may reach this buffer
+            while True:
+                ping_time = self.first_ping + ping_i * self.ping_period
+                if ping_time * self.fs >= b_end:
+                    break
+                rcr_bearing = self.ping_bearing(ping_i, ping_time)
+                pending += self.arrivals(ping_time, rcr_bearing)
+                ping_i += 1
+
+            buf = self.rng.randn(self.num_channels, self.buffer_size)
+            buf *= noise_std
+            buf = buf.astype(np.float32)
+
+            still_pending = []
+            for arrival in pending:
+                start_i, phase, channel, amp = arrival
+                if start_i >= b_end:
+                    still_pending.append(arrival)
+                    continue
+                # overlap of pulse with buffer
+                t0 = max(start_i, b_start)
+                t1 = min(start_i + self.table_size, b_end)
+                if t1 > t0:
+                    buf[channel, t0 - b_start: t1 - b_start] += amp \
+                        * self.pulse_table[phase, t0 - start_i: t1 - start_i]
+                if start_i + self.table_size > b_end:
+                    still_pending.append(arrival)
+            pending = still_pending
+
+            buffer_i += 1
+            yield buf
+
+    def __iter__(self):
+        """Simulator can be used directly as sim_gen"""
+        return self.buffers()
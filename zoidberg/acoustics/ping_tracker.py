@@ -0,0 +1,137 @@
+"""
+============
+Ping tracker
+============
+Estimate the repetition period of a pinger from confirmed arrival times, and
+predict a gate around the next expected ping. Arrival times are fit as
+t0 + m * period, where m is a whole number of periods. The time between every
+pair of saved arrivals is tried as the period, and the one that fits the most
+arrivals is kept, so missed pings and interference do not break the estimate.
+
+The tracker locks on once min_pings arrivals fit within tolerance. It loses
+lock after max_misses predicted gates pass with no arrival, and the history is
+cleared to start a new search. While locked, arrivals outside of the gate are
+only held as candidates. Interference does not move the track, but two
+candidates one period apart mean the pinger has moved, and the search starts
+again from them.
+"""
+import numpy as np
+from collections import deque
+
+
+class PingTracker:
+    """Pinger period estimate and arrival gate prediction"""
+    def __init__(self, min_pings=4, max_misses=2, gate_width=0.04,
+                 tolerance=0.005, num_history=8, min_period=0.2):
+        """min_pings is the number of consistent arrivals needed for lock
+        max_misses is the number of empty gates before lock is lost
+        gate_width is the full width of the gate around a prediction, (s)
+        tolerance is the largest fit residual of an arrival time, (s)
+        num_history is the number of arrival times saved
+        min_period is the shortest pinger period considered, (s)
+        """
+        self.min_pings = min_pings
+        self.max_misses = max_misses
+        self.gate_width = gate_width
+        self.tolerance = tolerance
+        self.min_period = min_period
+        self.times = deque(maxlen=num_history)
+        # arrivals outside of the gate while locked
+        self.candidates = deque(maxlen=num_history)
+
+        self.period = None
+        self.is_locked = False
+        # predicted time of next ping
+        self.next_arrival = None
+        self.num_misses = 0
+
+    def reset(self):
+        """Forget all arrivals and lose lock"""
+        self.times.clear()
+        self.candidates.clear()
+        self.period = None
+        self.is_locked = False
+        self.next_arrival = None
+        self.num_misses = 0
+
+    def add(self, arrival_time):
+        """Add a confirmed arrival time, (s)"""
+        self.times.append(arrival_time)
+        self.num_misses = 0
+        self._fit()
+
+    def add_candidate(self, arrival_time):
+        """Add an arrival outside of the gate, (s). It is held until another
+        candidate arrives one period before or after it, then the lock is
+        dropped and the history restarts from the two candidates.
+        returns True when the lock was dropped
+        """
+        c = np.array(self.candidates)
+        self.candidates.append(arrival_time)
+        if not (self.is_locked and c.size):
+            return False
+        agrees = np.abs(np.abs(arrival_time - c) - self.period) \
+               < self.tolerance
+        if not np.any(agrees):
+            return False
+        first = c[agrees][-1]
+        self.reset()
+        self.times.extend(sorted([first, arrival_time]))
+        return True
+
+    def _fit(self):
+        """Find the period that fits the most saved arrivals, then refine it
+        with a least squares fit of those arrivals. Every pair of arrivals is a
+        candidate period, so arrivals of interference are ignored.
+        """
+        t = np.array(self.times)
+        if t.size < self.min_pings:
+            self.is_locked = False
+            self.next_arrival = None
+            return
+
+        i, j = np.triu_indices(t.size, k=1)
+        period = t[j] - t[i]
+        valid = period >= self.min_period
+        i, period = i[valid], period[valid]
+        if period.size:
+            # whole number of periods between each candidate and all arrivals
+            m = np.round((t[None, :] - t[i, None]) / period[:, None])
+            residual = t[None, :] - (t[i, None] + m * period[:, None])
+            is_inlier = np.abs(residual) < self.tolerance
+            num_inliers = np.sum(is_inlier, axis=1)
+            # harmonics fit the same arrivals, prefer the longest period
+            best = np.lexsort((period, num_inliers))[-1]
+        if period.size and num_inliers[best] >= self.min_pings:
+            inliers = is_inlier[best]
+            A = np.stack([np.ones(np.sum(inliers)), m[best, inliers]], axis=1)
+            (t0, fit_period), _, _, _ = np.linalg.lstsq(A, t[inliers],
+                                                        rcond=None)
+            self.period = fit_period
+            self.is_locked = True
+            self.next_arrival = t0 + (np.max(m[best, inliers]) + 1) \
+                              * fit_period
+        elif not self.is_locked:
+            self.next_arrival = None
+        # a locked track keeps its prediction until its gates are missed
+
+    def update(self, now):
+        """Advance the prediction past gates that have ended by time now
+        returns True while the tracker is locked
+        """
+        if not self.is_locked:
+            return False
+        while now > self.next_arrival + self.gate_width / 2:
+            self.num_misses += 1
+            if self.num_misses >= self.max_misses:
+                self.reset()
+                return False
+            self.next_arrival += self.period
+        return True
+
+    def gate(self):
+        """Start and end time of the next gate, (s), or None without lock"""
+        if not self.is_locked:
+            return None
+        half = self.gate_width / 2
+        return self.next_arrival - half, self.next_arrival + half
@@ -0,0 +1,148 @@
+"""
+=========
+Recording
+=========
+Save raw int24 sound card buffers to memory-mapped files, and replay them as a
+BeagleFirmware sim_gen. Each chunk file holds a fixed number of records, every
+record is a buffer of raw bytes with the sample counter and epoch time of its
+first frame. Unused records at the end of the last chunk have a sample index of
+-1. Recording settings are saved in recording.json. A new recording replaces
+any chunks already in the folder.
+
+Record a session
+
+    bf = BeagleFirmware(fc, record_dir='tank_session')
+
+Replay it exactly, as fast as possible or paced to real time. Recorded sample
+counters and times are used, so buffers dropped during the session are
+handled as they were live.
+
+    bf = BeagleFirmware(fc)
+    bf.replay('tank_session')
+
+Or replay only the buffers as a sim_gen, where dropped buffers are not seen
+
+    bf = BeagleFirmware(fc, sim_gen=replay('tank_session'))
+"""
+import os
+import json
+import glob
+import numpy as np
+from time import time, sleep
+
+from int24_decoder import Int24Decoder
+
+
+def record_dtype(bytes_per_buffer):
+    """Structure of a single record"""
+    return np.dtype([('sample_index', '<i8'),
+                     ('utime', '<i8'),
+                     ('data', np.uint8, (bytes_per_buffer,))])
+
+
+class RawRecorder:
+    """Write raw buffers to chunked memory-mapped files"""
+    def __init__(self, record_dir, num_channels, buffer_size, fs,
+                 num_bytes=3, buffers_per_chunk=256):
+        """record_dir is created if it does not exist
+        buffers_per_chunk sets the size of each file
+        """
+        self.record_dir = record_dir
+        self.num_channels = num_channels
+        self.buffer_size = buffer_size
+        self.fs = fs
+        self.num_bytes = num_bytes
+        self.buffers_per_chunk = buffers_per_chunk
+        self.bytes_per_buffer = num_channels * buffer_size * num_bytes
+        self.dtype = record_dtype(self.bytes_per_buffer)
+
+        if not os.path.isdir(record_dir):
+            os.makedirs(record_dir)
+        # chunks of an earlier recording would be replayed after this one
+        for name in glob.glob(os.path.join(record_dir, 'chunk_*.dat')):
+            os.remove(name)
+        settings = dict(num_channels=num_channels,
+                        buffer_size=buffer_size,
+                        fs=fs,
+                        num_bytes=num_bytes,
+                        buffers_per_chunk=buffers_per_chunk)
+        with open(os.path.join(record_dir, 'recording.json'), 'w') as f:
+            json.dump(settings, f)
+
+        self.chunk_num = 0
+        self.record_i = 0
+        self.chunk = None
+        self._open_chunk()
+
+    def _open_chunk(self):
+        """Create the next chunk file"""
+        name = os.path.join(self.record_dir,
+                            'chunk_{:05d}.dat'.format(self.chunk_num))
+        self.chunk = np.memmap(name, dtype=self.dtype, mode='w+',
+                               shape=(self.buffers_per_chunk,))
+        self.chunk['sample_index'] = -1
+        self.record_i = 0
+
+    def write(self, buf, sample_index, utime):
+        """Save one buffer of raw bytes"""
+        if self.record_i == self.buffers_per_chunk:
+            self.chunk.flush()
+            self.chunk_num += 1
+            self._open_chunk()
+        record = self.chunk[self.record_i]
+        record['data'] = np.frombuffer(buf, dtype=np.uint8)
+        record['utime'] = utime
+        record['sample_index'] = sample_index
+        self.record_i += 1
+
+    def close(self):
+        """Flush last chunk to disk"""
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+
+
+def records(record_dir, realtime=False):
+    """Generator of recorded raw buffers, with the sample counter and epoch
+    time of their first frame, (us)
+    realtime paces buffers by their recorded sample index, otherwise buffers
+    are returned as fast as they are requested. Buffers are read only views
+    of the chunk files.
+    """
+    with open(os.path.join(record_dir, 'recording.json')) as f:
+        settings = json.load(f)
+    num_channels = settings['num_channels']
+    fs = settings['fs']
+    bytes_per_buffer = num_channels * settings['buffer_size'] \
+                     * settings['num_bytes']
+    dtype = record_dtype(bytes_per_buffer)
+
+    start_time = None
+    start_index = None
+    for name in sorted(glob.glob(os.path.join(record_dir, 'chunk_*.dat'))):
+        chunk = np.memmap(name, dtype=dtype, mode='r')
+        for record in chunk:
+            sample_index = int(record['sample_index'])
+            if sample_index < 0:
+                return
+            if realtime:
+                if start_time is None:
+                    start_time = time()
+                    start_index = sample_index
+                wait = start_time + (sample_index - start_index) / fs - time()
+                if wait > 0:
+                    sleep(wait)
+            yield record['data'], sample_index, int(record['utime'])
+
+
+def replay(record_dir, realtime=False):
+    """Generator of recorded buffers, shape (num_channels, buffer_size)
+    realtime paces buffers by their recorded sample index, otherwise buffers
+    are returned as fast as they are requested. The returned array is reused
+    for every buffer. Gaps from dropped buffers are not reported, see records.
+    """
+    with open(os.path.join(record_dir, 'recording.json')) as f:
+        settings = json.load(f)
+    decoder = Int24Decoder(settings['num_channels'], settings['buffer_size'])
+    for data, _, _ in records(record_dir, realtime=realtime):
+        yield decoder.decode(data)
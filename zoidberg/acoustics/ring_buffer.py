@@ -0,0 +1,75 @@
+"""
+===========
+Ring buffer
+===========
+Fixed size circular buffer of multi-channel samples. Every sample is written
+twice, once in each half of the storage array, so that any run of samples no
+longer than the capacity is available as a contiguous view. Samples are
+referenced by absolute index, the total number of samples written before it.
+"""
+import numpy as np
+
+
+class RingBuffer:
+    """Circular buffer with absolute sample index bookkeeping"""
+    def __init__(self, num_channels, capacity, dtype=np.complex64):
+        """capacity is the maximum number of samples saved per channel"""
+        self.num_channels = num_channels
+        self.capacity = capacity
+        self._data = np.zeros((num_channels, 2 * capacity), dtype=dtype)
+        # absolute index of the next sample to be written
+        self.count = 0
+
+    @property
+    def first(self):
+        """Absolute index of the oldest sample still saved"""
+        return max(0, self.count - self.capacity)
+
+    def append(self, samples):
+        """Add samples of shape (num_channels, N) to the end of the buffer"""
+        num_samples = samples.shape[1]
+        # only the last capacity samples can be saved
+        if num_samples > self.capacity:
+            self.count += num_samples - self.capacity
+            samples = samples[:, -self.capacity:]
+            num_samples = self.capacity
+        for dst, src in self._slots(num_samples):
+            self._data[:, dst] = samples[:, src]
+        self.count += num_samples
+
+    def skip(self, num_samples):
+        """Advance the buffer over num_samples of missing data, saved as 0"""
+        num_zero = min(num_samples, self.capacity)
+        self.count += num_samples - num_zero
+        for dst, _ in self._slots(num_zero):
+            self._data[:, dst] = 0
+        self.count += num_zero
+
+    def _slots(self, num_samples):
+        """Storage and source slices of the next num_samples written"""
+        cap = self.capacity
+        start = self.count % cap
+        first_size = min(num_samples, cap - start)
+        wrap_size = num_samples - first_size
+        # write up to the end of the first half, and its mirror
+        slots = [(slice(start, start + first_size), slice(0, first_size)),
+                 (slice(cap + start, cap + start + first_size),
+                  slice(0, first_size))]
+        # samples that wrap around to the begining of each half
+        if wrap_size > 0:
+            slots += [(slice(0, wrap_size), slice(first_size, num_samples)),
+                      (slice(cap, cap + wrap_size),
+                       slice(first_size, num_samples))]
+        return slots
+
+    def get(self, start, num_samples):
+        """Return a view of num_samples starting at absolute index start"""
+        if start < self.first or start + num_samples > self.count:
+            raise IndexError('requested samples are not in buffer')
+        i = start % self.capacity
+        return self._data[:, i: i + num_samples]
+
+    def reset(self):
+        """Clear all saved samples"""
+        self._data[:] = 0
+        self.count = 0
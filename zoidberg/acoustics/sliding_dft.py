@@ -0,0 +1,90 @@
+"""
+===========
+Sliding DFT
+===========
+Compute single frequency DFT bins of overlapping windows along a continous
+stream of data. A filter bank of several frequencies is computed in the same
+pass over the data. Windows are taken as strided views of a running buffer, so
+only winwidth multiplies are needed per section. The data in the last partial
+sections of a buffer is saved, and these sections are completed at the start
+of the next buffer.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class SlidingDFT:
+    """Windowed DFT bins at arbitrary section start positions"""
+    def __init__(self, twidle, section_i, buffer_size, num_channels):
+        """twidle is the windowed twidle factor vector, length winwidth
+        or a matrix of shape (winwidth, num_bins) for a filter bank
+        section_i are the start index of each section inside of a buffer
+        buffer_size is the number of samples in each buffer
+        num_channels is the number of channels in each buffer
+        """
+        self.buffer_size = buffer_size
+        self.num_channels = num_channels
+        self.winwidth = twidle.shape[0]
+
+        section_i = np.asarray(section_i)
+        # sections that fit completely inside a buffer
+        is_complete = section_i + self.winwidth < buffer_size
+        main_i = section_i[is_complete]
+        # sections that need data from the next buffer
+        tail_i = section_i[np.bitwise_not(is_complete)]
+
+        # saved samples at the end of each buffer
+        self.old_tail_size = buffer_size - tail_i[0]
+
+        # running buffer holds the old tail followed by the current buffer
+        self.stream = np.zeros((num_channels,
+                                self.old_tail_size + buffer_size),
+                               dtype=np.float32)
+        # position of each section in the running buffer, tail results first
+        self.section_i = np.hstack([tail_i - tail_i[0],
+                                    main_i + self.old_tail_size])
+        self.num_sections = self.section_i.size
+
+        # all possible windows in the running buffer, this is a view, no copy
+        num_windows = self.stream.shape[1] - self.winwidth + 1
+        s_ch, s_i = self.stream.strides
+        self._windows = as_strided(self.stream,
+                                   shape=(num_channels,
+                                          num_windows,
+                                          self.winwidth),
+                                   strides=(s_ch, s_i, s_i),
+                                   writeable=False)
+
+        # real and imaginary twidle factors are interleaved, so that the result
+        # of a real matrix multiply can be viewed as complex64 with no copy
+        twidle = np.asarray(twidle, dtype=np.complex64)
+        self.is_bank = twidle.ndim > 1
+        self.num_bins = twidle.shape[1] if self.is_bank else 1
+        self._twidle = np.zeros((self.winwidth, self.num_bins, 2),
+                                dtype=np.float32)
+        self._twidle[:, :, 0] = twidle.real.reshape(self.winwidth, -1)
+        self._twidle[:, :, 1] = twidle.imag.reshape(self.winwidth, -1)
+        self._twidle = self._twidle.reshape(self.winwidth, -1)
+
+    def process(self, recorded_data):
+        """Compute single frequency samples from a recorded time series
+        recorded_data has shape (num_channels, buffer_size)
+        output has shape (num_channels, num_sections), or
+        (num_channels, num_sections, num_bins) for a filter bank
+        """
+        self.stream[:, self.old_tail_size:] = recorded_data
+        # gather windows at each section start position
+        sections = self._windows[:, self.section_i]
+        # one real matrix multiply for all channels and sections
+        result = sections @ self._twidle
+        result = result.view(np.complex64)
+        # record tail values for next time around
+        self.stream[:, :self.old_tail_size] = \
+                self.stream[:, -self.old_tail_size:]
+        if self.is_bank:
+            return result
+        return result[:, :, 0]
+
+    def reset(self):
+        """Clear saved tail samples"""
+        self.stream[:] = 0
@@ -0,0 +1,124 @@
+"""
+====
+STFT
+====
+Short time Fourier transform of a continous stream of multi-channel buffers.
+Windows start every num_step samples, across buffer boundaries. Samples after
+the start of the next window are saved at the end of each buffer, and all
+windows of a buffer are strided views of a running buffer, so one batched rfft
+computes every channel and section.
+
+The channel average power of each section is saved in a rolling waterfall,
+which is used to find the frequency of a pinger inside a search band.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from ring_buffer import RingBuffer
+
+
+class STFT:
+    """Batched STFT with a rolling waterfall of power"""
+    def __init__(self, window, num_step, buffer_size, num_channels, fs,
+                 waterfall_time=2.):
+        """window is the window function, its length is the section length
+        num_step is the number of samples between section starts
+        waterfall_time is the length of saved power, (s)
+        """
+        self.window = np.asarray(window, dtype=np.float32)
+        self.winwidth = self.window.size
+        self.num_step = num_step
+        self.buffer_size = buffer_size
+        self.num_channels = num_channels
+        self.fs = fs
+        self.freqs = np.fft.rfftfreq(self.winwidth, 1 / fs)
+        self.num_bins = self.freqs.size
+
+        # running buffer, up to winwidth - 1 saved samples then the buffer
+        self.num_saved = self.winwidth - 1
+        self.stream = np.zeros((num_channels, self.num_saved + buffer_size),
+                               dtype=np.float32)
+        num_windows = self.stream.shape[1] - self.winwidth + 1
+        s_ch, s_i = self.stream.strides
+        self._windows = as_strided(self.stream,
+                                   shape=(num_channels, num_windows,
+                                          self.winwidth),
+                                   strides=(s_ch, s_i, s_i),
+                                   writeable=False)
+
+        # power of each bin, one column per section
+        capacity = int(waterfall_time * fs / num_step)
+        self.waterfall = RingBuffer(self.num_bins, capacity,
+                                    dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Clear saved samples and waterfall"""
+        self.stream[:] = 0
+        self.waterfall.reset()
+        # start of next section in the running buffer
+        self._next_i = self.num_saved
+
+    def process(self, recorded_data):
+        """Spectrum of every section that ends in this buffer
+        recorded_data has shape (num_channels, buffer_size)
+        output has shape (num_channels, num_sections, num_bins)
+        """
+        self.stream[:, self.num_saved:] = recorded_data
+        section_i = np.arange(self._next_i,
+                              self.stream.shape[1] - self.winwidth + 1,
+                              self.num_step)
+        spectrum = np.fft.rfft(self._windows[:, section_i] * self.window,
+                               axis=-1)
+
+        power = np.mean(spectrum.real ** 2 + spectrum.imag ** 2, axis=0)
+        self.waterfall.append(power.T)
+
+        # save samples from the next section start
+        self._next_i = (section_i[-1] if section_i.size else
+                        self._next_i - self.num_step) + self.num_step \
+                     - self.buffer_size
+        self.stream[:, :self.num_saved] = self.stream[:, -self.num_saved:]
+        return spectrum
+
+    def recent(self, duration=None):
+        """Waterfall of the last duration seconds, or all saved sections
+        output has shape (num_bins, num_sections), this is a view
+        """
+        num_saved = self.waterfall.count - self.waterfall.first
+        num_sections = num_saved if duration is None \
+                       else min(int(duration * self.fs / self.num_step),
+                                num_saved)
+        return self.waterfall.get(self.waterfall.count - num_sections,
+                                  num_sections)
+
+    def peak_frequency(self, band=None, duration=None, min_snr=10.):
+        """Frequency of the strongest bin in the recent waterfall, (Hz)
+        band is the (low, high) search range, (Hz)
+        Each bin is scored by its largest power over time, so short pings are
+        found. Returns None when the peak is less than min_snr, (dB), above
+        the median score of the band.
+        """
+        waterfall = self.recent(duration)
+        if waterfall.shape[1] == 0:
+            return None
+        in_band = np.ones(self.num_bins, dtype=bool)
+        if band is not None:
+            in_band = (self.freqs >= band[0]) & (self.freqs <= band[1])
+        score = np.zeros(self.num_bins)
+        score[in_band] = np.max(waterfall[in_band], axis=1)
+
+        peak_i = np.argmax(score)
+        floor = np.median(score[in_band])
+        if score[peak_i] <= floor * 10 ** (min_snr / 10):
+            return None
+
+        # parabola through log power of the peak and its neighbors
+        delta = 0.
+        if 0 < peak_i < self.num_bins - 1 and in_band[peak_i - 1] \
+                and in_band[peak_i + 1]:
+            left, center, right = np.log(score[peak_i - 1: peak_i + 2])
+            curve = left - 2 * center + right
+            if curve < 0:
+                delta = 0.5 * (left - right) / curve
+        return self.freqs[peak_i] + delta * (self.freqs[1] - self.freqs[0])
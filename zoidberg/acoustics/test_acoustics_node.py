@@ -0,0 +1,156 @@
+"""
+===================
+Acoustics node test
+===================
+Run the node on synthetic audio_data_v2_t messages, without the beagle. Run
+with pytest from the acoustics/ folder.
+"""
+import numpy as np
+import pytest
+import queue
+import threading
+from time import sleep
+
+lcm = pytest.importorskip('lcm')
+from zoidberg_lcm import audio_data_v2_t
+from acoustics_node import AcousticsNode
+from ping_simulator import PingSimulator
+import audio_payload
+
+fc = 30000
+fs = 96000
+num_step = 64
+msg_size = 64  # samples in each message
+start_time = 1000.  # epoch time of first sample, (s)
+
+
+def make_messages(ping_times, duration, seed=0):
+    """Encoded messages of noise with a short pulse at each ping time"""
+    rng = np.random.RandomState(seed)
+    rate = fs / num_step
+    num_samples = int(duration * rate) // msg_size * msg_size
+    samples = rng.randn(3, num_samples) + 1j * rng.randn(3, num_samples)
+    samples *= 1e-3 / np.sqrt(2)
+    for t in ping_times:
+        ping_i = int(round((t - start_time) * rate))
+        samples[:, ping_i: ping_i + 6] += 0.1
+    messages = []
+    for msg_i in range(0, num_samples, msg_size):
+        msg = audio_data_v2_t()
+        msg.utime = int(round((start_time + msg_i / rate) * 1e6))
+        msg.sample_index = msg_i
+        msg.fc = fc
+        msg.num_step = num_step
+        msg.fs = fs
+        audio_payload.encode_samples(msg,
+                                     samples[:, msg_i: msg_i + msg_size])
+        messages.append(msg.encode())
+    return messages
+
+
+def run_node(node, messages):
+    """Arrival time of each published ping, and tracker lock at that time"""
+    pings = []
+    node.subscribe(lambda ping: pings.append((ping['arrival_time'],
+                                              node.tracker.is_locked)))
+    for data in messages:
+        node.handle_message(data)
+    return pings
+
+
+def test_gate_holds_bursts():
+    """Off period bursts are not published, and the lock holds"""
+    period = 0.5
+    # bursts are between the gates, after the dead time of each ping
+    ping_times = start_time + 0.3 + period * np.arange(12)
+    burst_times = start_time + np.array([2.05, 2.58, 3.56, 4.07, 5.05, 5.54])
+    messages = make_messages(np.concatenate([ping_times, burst_times]), 6.)
+
+    node = AcousticsNode(fc)
+    pings = run_node(node, messages)
+    times = np.array([t for t, _ in pings])
+    was_locked = np.array([is_locked for _, is_locked in pings])
+
+    assert node.tracker.is_locked
+    assert node.num_monitored >= burst_times.size
+    assert len(node.tracker.candidates) == burst_times.size
+    # no published ping is a burst, and none are missed once locked
+    err = np.min(np.abs(times[:, None] - ping_times[None, :]), axis=1)
+    assert np.all(err < 0.01)
+    locked_times = times[np.argmax(was_locked):]
+    assert locked_times.size == np.sum(ping_times > locked_times[0] - 0.01)
+
+
+def test_gate_follows_moved_pinger():
+    """Pings that move out of the gate are held, then followed once two of
+    them agree with the period
+    """
+    period = 0.5
+    ping_times = start_time + 0.3 + period * np.arange(14)
+    ping_times[8:] -= 0.2
+    messages = make_messages(ping_times, 7.)
+
+    node = AcousticsNode(fc)
+    pings = run_node(node, messages)
+    times = np.array([t for t, _ in pings])
+
+    assert node.tracker.is_locked
+    # the two moved pings are only candidates, later ones are published
+    moved = times[times > ping_times[7] + 0.01]
+    assert np.allclose(moved, ping_times[10: 10 + moved.size], atol=0.01)
+    assert moved.size == np.sum(ping_times[10:] < start_time + 7.)
+    assert abs(node.tracker.next_arrival - times[-1] - period) < 0.01
+
+
+def test_worker_survives_bad_message():
+    """A message that can not be decoded does not stop the worker"""
+    messages = make_messages([], 1.)
+    node = AcousticsNode(fc)
+    node.msg_queue = queue.Queue()
+    node.msg_queue.put(messages[0][:20])
+    for data in messages:
+        node.msg_queue.put(data)
+
+    worker = threading.Thread(target=node._get_worker())
+    worker.start()
+    try:
+        for _ in range(100):
+            if node.num_processed == len(messages):
+                break
+            sleep(0.02)
+    finally:
+        node.stop_threads = True
+        worker.join()
+    assert node.num_errors == 1
+    assert node.num_processed == len(messages)
+    assert node.ring.count == len(messages) * msg_size
+
+
+@pytest.mark.parametrize('noise_level', [1e-5, 1e-3])
+def test_threshold_detection(noise_level):
+    """Default fixed threshold finds simulated pings, and no noise"""
+    pytest.importorskip('pyaudio')
+    import beagle_firmware
+    from beagle_firmware import BeagleFirmware
+
+    bf = BeagleFirmware(fc)
+    sim = PingSimulator(fc=fc, fs=bf.fs, buffer_size=bf.buffer_size,
+                        noise_level=noise_level, first_ping=0.3,
+                        duration=6., seed=1)
+    # first processed sample starts in the tail of the previous buffer
+    tail_start = beagle_firmware.tail_i[0] - bf.buffer_size
+    messages = []
+    for buffer_i, recorded_data in enumerate(sim.buffers()):
+        start = buffer_i * bf.buffer_size + tail_start
+        messages += bf.encode(bf.process(recorded_data),
+                              int(round(start / bf.fs * 1e6)))
+
+    node = AcousticsNode(fc)
+    node.detection = 'threshold'
+    times = np.array([t for t, _ in run_node(node, messages)])
+
+    r_dir = np.sqrt(sim.rcr_range ** 2
+                    + (sim.rcr_depth - sim.source_depth) ** 2)
+    ping_times = 0.3 + np.arange(6) + r_dir / sim.c
+    assert times.size == ping_times.size
+    assert np.all(np.abs(times - ping_times) < 0.01)
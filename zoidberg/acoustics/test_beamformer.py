@@ -0,0 +1,101 @@
+"""
+===============
+Beamformer test
+===============
+Bearing of a plane wave from a known direction, for each estimator and array
+geometry. Run with pytest from the acoustics/ folder.
+"""
+import numpy as np
+import pytest
+from math import pi
+
+from array_geometry import ArrayGeometry
+from beamformer import Beamformer, methods
+from gcc_phat import GccPhat
+
+fc = 30000
+fs = 96000
+c = 1480.
+dx = 0.0185
+
+geometries = {
+    'line': ArrayGeometry.line_array(3, dx),
+    'planar': ArrayGeometry([[0, 0, 0], [dx, 0, 0], [0, dx, 0]]),
+    '3d': ArrayGeometry([[0, 0, 0], [dx, 0, 0], [0, dx, 0], [0, 0, dx]]),
+}
+# direction of the source for each geometry, (azimuth, elevation)
+sources = {'line': (0.5, 0.), 'planar': (0.5, -0.3), '3d': (0.5, -0.3)}
+
+
+def plane_wave(geometry, azimuth, elevation, pulse_width=0.008,
+               num_samples=1024, seed=0):
+    """Raw samples of a pulse from the source direction, centered in the
+    window. The pulse reaches the element at p earlier by p . u / c
+    """
+    u = np.array([np.sin(azimuth) * np.cos(elevation),
+                  np.cos(azimuth) * np.cos(elevation),
+                  np.sin(elevation)])
+    delay = -geometry.positions @ u / c
+    t = (np.arange(num_samples) - num_samples / 2) / fs - delay[:, None]
+    envelope = np.where(np.abs(t) < pulse_width / 2,
+                        np.cos(pi * t / pulse_width) ** 2, 0.)
+    raw = np.sin(2 * pi * fc * t) * envelope
+    rng = np.random.RandomState(seed)
+    return raw + 1e-3 * rng.randn(*raw.shape)
+
+
+def snapshots(raw, winwidth=256, num_step=64, num_snapshots=4):
+    """Baseband snapshots, a windowed DFT bin as computed by the beagle"""
+    n = np.arange(winwidth)
+    twidle = np.exp(-2j * pi * fc * n / fs) * np.hanning(winwidth)
+    start = raw.shape[-1] // 2 - winwidth
+    beams = [raw[:, s: s + winwidth] @ twidle
+             for s in start + num_step * np.arange(num_snapshots)]
+    return np.stack(beams, axis=-1)
+
+
+@pytest.mark.parametrize('method', methods)
+@pytest.mark.parametrize('name', sorted(geometries))
+def test_source_direction(name, method):
+    """Plane wave is found at the direction of its source"""
+    geometry = geometries[name]
+    azimuth, elevation = sources[name]
+    beamformer = Beamformer(geometry, fc, c, method=method)
+    beams = snapshots(plane_wave(geometry, azimuth, elevation))
+    est_az, est_el, _, width = beamformer.beamform(
+            beamformer.cross_spectral(beams))
+    assert abs(est_az - azimuth) < 0.02
+    assert 0 < width < pi
+    if name == 'planar':
+        # a z = 0 array can not tell up from down
+        assert abs(abs(est_el) - abs(elevation)) < 0.02
+    else:
+        assert abs(est_el - elevation) < 0.02
+
+
+@pytest.mark.parametrize('method', methods)
+@pytest.mark.parametrize('name', ['planar', '3d'])
+def test_beam_width_wraps(name, method):
+    """Beam width of a source at the edge of a full azimuth scan"""
+    geometry = geometries[name]
+    beamformer = Beamformer(geometry, fc, c, method=method)
+    beams = snapshots(plane_wave(geometry, pi - 0.01, 0.))
+    _, _, _, width = beamformer.beamform(beamformer.cross_spectral(beams))
+    assert 0 < width < pi
+
+
+@pytest.mark.parametrize('name', sorted(geometries))
+def test_gcc_phat_direction(name):
+    """Time differences of a short pulse give the same direction"""
+    geometry = geometries[name]
+    azimuth, elevation = sources[name]
+    gcc = GccPhat(geometry, fs, c, window_size=1024,
+                  band=(fc - 5000, fc + 5000))
+    raw = plane_wave(geometry, azimuth, elevation, pulse_width=0.0005)
+    est_az, est_el = gcc.bearing(raw)
+    # delays of a small array are a fraction of a sample
+    assert abs(est_az - azimuth) < 0.05
+    if name == 'planar':
+        assert abs(abs(est_el) - abs(elevation)) < 0.1
+    elif name == '3d':
+        assert abs(est_el - elevation) < 0.1
@@ -9,26 +9,39 @@ beamforming.
 """
 import numpy as np
 from math import pi
-from scipy.signal import stft
 import matplotlib.pyplot as plt
 
 import bearing_simulation
 import beagle_firmware
 import acoustics_node
+from stft import STFT
 
 cmap = plt.cm.magma_r
 cmap.set_under('w')
 
-all_data = list(bearing_simulation.get_buffer())
-all_data = np.concatenate(all_data, axis=1)
-
 window = beagle_firmware.window
+stft = STFT(window, beagle_firmware.num_step, beagle_firmware.buffer_size,
+            bearing_simulation.num_channels, bearing_simulation.fs)
 
-an = acoustics_node.AcousticsNode(bearing_simulation.fc)
+# spectrum of every section, shape (channels, frequency, time)
+p_ft = [stft.process(b) for b in bearing_simulation.get_buffer()]
+p_ft = np.concatenate(p_ft, axis=1).transpose(0, 2, 1)
+f = stft.freqs
+t = (np.arange(p_ft.shape[2]) * stft.num_step + window.size / 2) \
+    / bearing_simulation.fs
 
-f, t, p_ft = stft(all_data, window=window,
-                     nperseg=window.size, fs=96000,
-                     noverlap=window.size - beagle_firmware.num_step)
+# pinger frequency found from the last seconds of the waterfall
+peak = stft.peak_frequency(band=(20e3, 40e3))
+if peak is None:
+    print('peak frequency: no peak')
+else:
+    print('peak frequency {:.0f} Hz'.format(peak))
+
+an = acoustics_node.AcousticsNode(bearing_simulation.fc)
+# oversample in possible look directions for plotting
+num_look = 300
+look_directions = np.arange(num_look) * pi / num_look - pi / 2
+look_vectors = an.beamformer.steering(look_directions)
 
 pdB = 20 * np.log10(np.abs(p_ft))
 pdB -= np.max(pdB)
@@ -48,8 +61,8 @@ for p in byping:
     testi = np.argmax(p)
     _, fi, testi = np.unravel_index(testi, p.shape)
     p_comp = p[:, fi, testi]
-    K = np.outer(np.conj(p_comp), p_comp)
-    B = np.sum((np.conj(an.look_vectors).T @ K) * an.look_vectors.T, axis=1)
+    K = np.outer(p_comp, np.conj(p_comp))
+    B = an.beamformer.power(K, look_vectors)
     Bs.append(B)
 
 Bs = np.array(Bs)
@@ -58,7 +71,7 @@ b_dB -= np.max(b_dB)
 
 fig, ax = plt.subplots()
 for i in np.arange(5) * 8:
-    ax.plot(an.look_directions, np.abs(Bs[i, :]), 'k')
+    ax.plot(look_directions, np.abs(Bs[i, :]), 'k')
     tb = np.radians(bearing_simulation.test_bearings[i])
     ax.plot([tb, tb], [0, 0.1], color='0.6')
 
@@ -4,3 +4,5 @@ DO NOT MODIFY BY HAND!!!!
 """
 
 from .audio_data_t import audio_data_t
+from .audio_data_v2_t import audio_data_v2_t
+from .audio_status_t import audio_status_t
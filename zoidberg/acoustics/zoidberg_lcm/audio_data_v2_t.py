@@ -0,0 +1,72 @@
+"""LCM type definitions
+This file automatically generated by lcm.
+DO NOT MODIFY BY HAND!!!!
+"""
+
+try:
+    import cStringIO.StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+import struct
+
+class audio_data_v2_t(object):
+    __slots__ = ["utime", "sample_index", "num_channels", "num_samples", "fc", "fs", "num_step", "encoding", "scale", "num_bytes", "samples"]
+
+    __typenames__ = ["int64_t", "int64_t", "int32_t", "int32_t", "int32_t", "int32_t", "int32_t", "int8_t", "float", "int32_t", "byte"]
+
+    __dimensions__ = [None, None, None, None, None, None, None, None, None, None, ["num_bytes"]]
+
+    def __init__(self):
+        self.utime = 0
+        self.sample_index = 0
+        self.num_channels = 0
+        self.num_samples = 0
+        self.fc = 0
+        self.fs = 0
+        self.num_step = 0
+        self.encoding = 0
+        self.scale = 0.0
+        self.num_bytes = 0
+        self.samples = b""
+
+    def encode(self):
+        buf = BytesIO()
+        buf.write(audio_data_v2_t._get_packed_fingerprint())
+        self._encode_one(buf)
+        return buf.getvalue()
+
+    def _encode_one(self, buf):
+        buf.write(struct.pack(">qqiiiiibfi", self.utime, self.sample_index, self.num_channels, self.num_samples, self.fc, self.fs, self.num_step, self.encoding, self.scale, self.num_bytes))
+        buf.write(bytearray(self.samples[:self.num_bytes]))
+
+    def decode(data):
+        if hasattr(data, 'read'):
+            buf = data
+        else:
+            buf = BytesIO(data)
+        if buf.read(8) != audio_data_v2_t._get_packed_fingerprint():
+            raise ValueError("Decode error")
+        return audio_data_v2_t._decode_one(buf)
+    decode = staticmethod(decode)
+
+    def _decode_one(buf):
+        self = audio_data_v2_t()
+        self.utime, self.sample_index, self.num_channels, self.num_samples, self.fc, self.fs, self.num_step, self.encoding, self.scale, self.num_bytes = struct.unpack(">qqiiiiibfi", buf.read(45))
+        self.samples = buf.read(self.num_bytes)
+        return self
+    _decode_one = staticmethod(_decode_one)
+
+    _hash = None
+    def _get_hash_recursive(parents):
+        if audio_data_v2_t in parents: return 0
+        tmphash = (0xbfb673f9149d7ba1) & 0xffffffffffffffff
+        tmphash  = (((tmphash<<1)&0xffffffffffffffff) + (tmphash>>63)) & 0xffffffffffffffff
+        return tmphash
+    _get_hash_recursive = staticmethod(_get_hash_recursive)
+    _packed_fingerprint = None
+
+    def _get_packed_fingerprint():
+        if audio_data_v2_t._packed_fingerprint is None:
+            audio_data_v2_t._packed_fingerprint = struct.pack(">Q", audio_data_v2_t._get_hash_recursive([]))
+        return audio_data_v2_t._packed_fingerprint
+    _get_packed_fingerprint = staticmethod(_get_packed_fingerprint)
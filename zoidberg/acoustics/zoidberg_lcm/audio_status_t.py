@@ -0,0 +1,69 @@
+"""LCM type definitions
+This file automatically generated by lcm.
+DO NOT MODIFY BY HAND!!!!
+"""
+
+try:
+    import cStringIO.StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+import struct
+
+class audio_status_t(object):
+    __slots__ = ["utime", "sample_index", "fc", "num_channels", "noise_floor", "num_triggers"]
+
+    __typenames__ = ["int64_t", "int64_t", "int32_t", "int32_t", "float", "int32_t"]
+
+    __dimensions__ = [None, None, None, None, ["num_channels"], None]
+
+    def __init__(self):
+        self.utime = 0
+        self.sample_index = 0
+        self.fc = 0
+        self.num_channels = 0
+        self.noise_floor = []
+        self.num_triggers = 0
+
+    def encode(self):
+        buf = BytesIO()
+        buf.write(audio_status_t._get_packed_fingerprint())
+        self._encode_one(buf)
+        return buf.getvalue()
+
+    def _encode_one(self, buf):
+        buf.write(struct.pack(">qqii", self.utime, self.sample_index, self.fc, self.num_channels))
+        buf.write(struct.pack('>%df' % self.num_channels, *self.noise_floor[:self.num_channels]))
+        buf.write(struct.pack(">i", self.num_triggers))
+
+    def decode(data):
+        if hasattr(data, 'read'):
+            buf = data
+        else:
+            buf = BytesIO(data)
+        if buf.read(8) != audio_status_t._get_packed_fingerprint():
+            raise ValueError("Decode error")
+        return audio_status_t._decode_one(buf)
+    decode = staticmethod(decode)
+
+    def _decode_one(buf):
+        self = audio_status_t()
+        self.utime, self.sample_index, self.fc, self.num_channels = struct.unpack(">qqii", buf.read(24))
+        self.noise_floor = struct.unpack('>%df' % self.num_channels, buf.read(self.num_channels * 4))
+        self.num_triggers = struct.unpack(">i", buf.read(4))[0]
+        return self
+    _decode_one = staticmethod(_decode_one)
+
+    _hash = None
+    def _get_hash_recursive(parents):
+        if audio_status_t in parents: return 0
+        tmphash = (0x3111fc38df10446d) & 0xffffffffffffffff
+        tmphash  = (((tmphash<<1)&0xffffffffffffffff) + (tmphash>>63)) & 0xffffffffffffffff
+        return tmphash
+    _get_hash_recursive = staticmethod(_get_hash_recursive)
+    _packed_fingerprint = None
+
+    def _get_packed_fingerprint():
+        if audio_status_t._packed_fingerprint is None:
+            audio_status_t._packed_fingerprint = struct.pack(">Q", audio_status_t._get_hash_recursive([]))
+        return audio_status_t._packed_fingerprint
+    _get_packed_fingerprint = staticmethod(_get_packed_fingerprint)
@@ -3,9 +3,15 @@
 Vision Node
 ===========
 Handles detections, logs and stores latest values
+
+Detectors are registered by name, with the frame inputs they need. All enabled
+detectors run on each frame in parallel on a thread pool, OpenCV releases the
+GIL while it works, and their detections are merged into one list.
 """
 import os
 import cv2
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import datetime
 import numpy as np
@@ -13,6 +19,38 @@ import numpy as np
 from zoidberg import Detection
 from zoidberg.utils import timestamp
 
+def _segment_argmin(values, starts, segment):
+    """Index of the first minimum of each segment of a 1D array
+    starts is the index of the first value of each segment, and segment is
+    the segment number of every value
+    """
+    segment_min = np.minimum.reduceat(values, starts)
+    is_min = np.flatnonzero(values == segment_min[segment])
+    _, first = np.unique(segment[is_min], return_index=True)
+    return is_min[first]
+
+class Detector:
+    """A vision detector, and the frame inputs it needs"""
+    def __init__(self, find, inputs=('image',), object_IDs=()):
+        """find is called with the frame inputs, in order, and returns a list
+        of Detection. It runs at the same time as other detectors, so it
+        should not change its inputs or shared state. Work images it reuses
+        between frames are kept for each thread.
+        inputs are image, depth or both
+        object_IDs are the IDs of the detections it outputs
+        """
+        for name in inputs:
+            if name not in ('image', 'depth'):
+                raise ValueError('Unknown detector input {}'.format(name))
+        self.find = find
+        self.inputs = tuple(inputs)
+        self.object_IDs = tuple(object_IDs)
+
+    def __call__(self, image, depth):
+        """Run detector on one frame"""
+        frame = dict(image=image, depth=depth)
+        return self.find(*[frame[name] for name in self.inputs])
+
 class VisionNode:
     """Node used by mission to handle detections"""
     def __init__(self):
@@ -24,6 +62,75 @@ class VisionNode:
         self.l_gate_ID = 3  # integer left gate detection ID
         self.g_gate_ID = 4  # integer full gate detection ID
 
+        # noise removal kernel of rectangle buoy
+        self.rect_kernel = np.ones((5, 5), np.uint8)
+
+        # gate structuring elements, built once
+        self.gradient_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+        self.leg_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 10))
+        self.close_kernel = np.ones((45, 45), np.uint8)
+        # gate legs fill more than a fraction of their bounding box, tried
+        # from strict to loose, and have a minimum area, (pixels)
+        self.fill_levels = [0.6, 0.5, 0.4, 0.3, 0.2, 0.1, 0.]
+        self.leg_min_area = 20 * 20
+        # gate legs are separated in x and at the same height, (pixels)
+        self.leg_min_dx = 100
+        self.leg_max_dy = 50
+        # gate work images, reused between frames of the same size. Each
+        # thread has its own, so gate masks can be found at the same time
+        self._gate_local = threading.local()
+
+        # registered detectors, and the names of those run by detect
+        self.detectors = {}
+        self.register('gate', Detector(self._find_gate,
+                                       object_IDs=(self.r_gate_ID,
+                                                   self.l_gate_ID,
+                                                   self.g_gate_ID)))
+        self.register('buoy', Detector(self._find_buoy,
+                                       object_IDs=(self.buoy_ID,)))
+        self.register('rect', Detector(self._find_rect,
+                                       object_IDs=(self.buoy_ID,)))
+        self.enabled = ['gate', 'buoy']
+        self.num_workers = 4  # number of detector threads
+        self._pool = None
+
+    def register(self, name, detector):
+        """Add a detector, it is not run until it is enabled"""
+        self.detectors[name] = detector
+
+    def enable(self, *names):
+        """Set the detectors that are run on each frame, by name"""
+        for name in names:
+            if name not in self.detectors:
+                raise ValueError('Unknown detector {}'.format(name))
+        self.enabled = list(names)
+
+    def detect(self, image, depth=None):
+        """Run all enabled detectors on one frame, in parallel
+        returns the detections of every detector, in the enabled order. These
+        are also saved as the latest detections.
+        """
+        self.frame_num += 1
+        detectors = [self.detectors[name] for name in self.enabled]
+        if len(detectors) == 1:
+            results = [detectors[0](image, depth)]
+        else:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.num_workers)
+            futures = [self._pool.submit(detector, image, depth)
+                       for detector in detectors]
+            results = [future.result() for future in futures]
+
+        self.detections = [detection for result in results
+                           for detection in result]
+        return self.detections
+
+    def close(self):
+        """Stop detector threads"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
     def buoy_detection(self, ts, ul, lr):
         """Create Detection class instance to store info"""
         detection = Detection()
@@ -32,7 +139,7 @@ class VisionNode:
                         ts,
                         ul,
                         lr)
-        self.detections.append(detection)
+        return detection
 
     def gate_detection(self, gate_legs):
         """Gate detection object creation"""
@@ -114,23 +221,21 @@ class VisionNode:
 
         g.write_gate(self.frame_num, self.g_gate_ID, timestamp(), gate_ul_x, gate_ul_y, gate_br_x, gate_br_y, \
                      gate_w, gate_h)
-        
-        self.frame_num += 1
-        self.detections.append(r)
-        self.detections.append(l)
-        self.detections.append(g)
+
+        return [r, l, g]
 
     def find_buoy(self, img):
         """Find objects by contour"""
+        # Step the frame number
+        self.frame_num += 1
+        self.detections = self._find_buoy(img)
+
+    def _find_buoy(self, img):
+        """Buoy detections of one image"""
         # set the minimum and maximum distance ratios for valid buoys
         ratioMax = 0.5
         ratioMin = 0.2
 
-        # Step the frame number
-        self.frame_num += 1
-
-        # make copies of images
-        img_color = img.copy()
         scan_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
         # initial function scan to find all contours
@@ -139,113 +244,92 @@ class VisionNode:
         scan_img = cv2.erode(scan_img, None, iterations=1)
         scan_img = cv2.dilate(scan_img, None, iterations=1)
 
-
-        # find contours
+        # find contours, OpenCV 3 also returns the image first
         contours = cv2.findContours(scan_img,
                                     cv2.RETR_EXTERNAL,
-                                    cv2.CHAIN_APPROX_SIMPLE)
-        contours = contours[1]
-
-        # initialize buoy array and counter
-        buoys = []
-
-        # loop through found contours to make decisions
-        for contour in contours:
-            # if the length of the contour is long enough to be a potential buoy
-            if (len(contour) > 45):
-
-                # find coordinates in the frame for buoy validation
-                max_Pt = [9999999, 9999999]  # highest y point, huge values for safety
-                endPt1 = [9999999999, 0]  # the highest y point with lowest x coordinate
-                endPt2 = [-1, 0]  # point with the highest x coordinate
-
-                for Point in contour:
-                    # temporary coordinates for comparison
-                    temp_y = Point[0][1]
-                    temp_x = Point[0][0]
-
-                    # make decision based on location of temporary x and y coords
-                    if (temp_y < max_Pt[1]):
-                        max_Pt = Point[0]
-                    if (temp_x < endPt1[0]):
-                        endPt1 = Point[0]
-                    if (temp_x > endPt2[0]):
-                        endPt2 = Point[0]
-
-                # store endPt1's coordinates into finalEndPt for comparison
-                finalEndPt = endPt1;
-                if (endPt1[1] > endPt2[1]):
-                    finalEndPt = endPt2;
-
-                # calculate width and height of contour
-                w = abs(max_Pt[0] - finalEndPt[0])
-                h = abs(max_Pt[1] - finalEndPt[1])
-
-                # compute ratio necessary for a contour to be considered a buoy,
-                # noise can still be considered a buoy
-                if (w != 0):
-                    ratio = (h / (2 * w))
-                else:
-                    ratio = 0
-
-                if ratio >= ratioMin and ratio <= ratioMax:
-                         buoys.append(contour)
-
-
-        # initialize object array and ID count
-        self.detections = []
-
-        for buoy in buoys:
-            # find inital (x, y) coordinates and radius of contour
-            (x,y), radius = cv2.minEnclosingCircle(buoy)
-            x_coord = int(x)
-            y_coord = int(y)
-            center = (x_coord, y_coord)
-            radius = int(radius)
-
-            # *** remove contours that are just noise ***
-            # find arbitrary distance away from the center
-            dist = radius / 4
-
-            # for storing pixels that could potentially be noise
-            outliers = 0;
-
-            for point in buoy:
-                point = point[0]
-                # determine if a pixel is an outlier based on y-coord position from center
-                if point[1] > center[1] and (point[0] > center[0] - dist and \
-                                    point[0] < center[0] + dist):
-                    outliers += 1
-
-            # if too many outliers were found, it's noise
-            if (outliers > 1):
-                continue
-
+                                    cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+        # only contours that are long enough to be a potential buoy
+        contours = [c for c in contours if len(c) > 45]
+        detections = []
+        if not contours:
+            return detections
+
+        # all points in one array, with the contour number of each point
+        points = np.concatenate(contours)[:, 0, :]
+        lengths = np.array([len(c) for c in contours])
+        starts = np.hstack([0, np.cumsum(lengths[:-1])])
+        segment = np.repeat(np.arange(len(contours)), lengths)
+        px = points[:, 0]
+        py = points[:, 1]
+
+        # highest point, and the points with the lowest and highest x
+        max_pt = points[_segment_argmin(py, starts, segment)]
+        end_pt1 = points[_segment_argmin(px, starts, segment)]
+        end_pt2 = points[_segment_argmin(-px, starts, segment)]
+        final_end_pt = np.where((end_pt1[:, 1] > end_pt2[:, 1])[:, None],
+                                end_pt2, end_pt1)
+
+        # calculate width and height of contour
+        w = np.abs(max_pt[:, 0] - final_end_pt[:, 0])
+        h = np.abs(max_pt[:, 1] - final_end_pt[:, 1])
+
+        # compute ratio necessary for a contour to be considered a buoy,
+        # noise can still be considered a buoy
+        ratio = np.zeros(w.shape)
+        np.divide(h, 2 * w, out=ratio, where=w != 0)
+        is_buoy = (ratio >= ratioMin) & (ratio <= ratioMax)
+
+        # find inital (x, y) coordinates and radius of each buoy
+        circles = np.zeros((len(contours), 3))
+        for i in np.flatnonzero(is_buoy):
+            (x, y), radius = cv2.minEnclosingCircle(contours[i])
+            circles[i] = int(x), int(y), int(radius)
+        center_x, center_y, radius = circles.T
+
+        # *** remove contours that are just noise ***
+        # points below the center, and within a distance from it in x, could
+        # be noise
+        dist = radius / 4
+        is_outlier = (py > center_y[segment]) \
+                   & (px > center_x[segment] - dist[segment]) \
+                   & (px < center_x[segment] + dist[segment])
+        outliers = np.bincount(segment, weights=is_outlier,
+                               minlength=len(contours))
+        is_buoy &= outliers <= 1
+
+        circles = circles[is_buoy].astype(int).tolist()
+        for x_coord, y_coord, radius in circles:
             # compute bounding boxes
             bb_ul = (x_coord - radius, y_coord - radius)
             bb_lr = (x_coord + radius, y_coord + radius)
 
             # relay information to detection creator
-            self.buoy_detection(timestamp(),
-                                  bb_ul,
-                                  bb_lr)
+            detections.append(self.buoy_detection(timestamp(),
+                                                  bb_ul,
+                                                  bb_lr))
+        return detections
 
     def find_rect(self, image, depth):
         """Single rectangular buoy detection"""
-        markers = 0
-        threshold = 10
-
-        # find buoy by changing blue channel threshold
-        while (np.amax(markers) == 0):
-            threshold += 5
-            temp_t, img = cv2.threshold(image[:,:,0], threshold, 255, cv2.THRESH_BINARY_INV)
-            cv2.imshow('img', img)
-            _, markers = cv2.connectedComponents(img)
-
-        # define kernal and remove noise
-        kernal = np.ones((5,5), np.uint8)
-        img = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernal)
-        img = cv2.morphologyEx(img, cv2.MORPH_DILATE, kernal)
+        self.frame_num += 1
+        self.detections = self._find_rect(image) or None
+
+    def _find_rect(self, image):
+        """Rectangular buoy detection of one image, at most one"""
+        # find buoy with the lowest blue channel threshold, in steps of 5
+        # from 15, that has a pixel at or below it. This is the first step
+        # where the cumulative count of the blue histogram is not 0.
+        blue = cv2.extractChannel(image, 0)
+        darkest = cv2.minMaxLoc(blue)[0]
+        num_steps = max(int(np.ceil((darkest - 15) / 5)), 0)
+        threshold = min(15 + 5 * num_steps, 255)
+        _, img = cv2.threshold(blue, threshold, 255, cv2.THRESH_BINARY_INV,
+                               dst=blue)
+
+        # remove noise
+        img = cv2.morphologyEx(img, cv2.MORPH_OPEN, self.rect_kernel)
+        img = cv2.morphologyEx(img, cv2.MORPH_DILATE, self.rect_kernel)
 
         # get pixels of buoy and relay information
         nonzero = cv2.findNonZero(img)
@@ -258,24 +342,26 @@ class VisionNode:
         # determine if detected object is ideal
         if ((x != 0 and y != 0) or (h > 20 and w > 20)):
             # ideal detected object was found
-            cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
             x_c = int(x)
             y_c = int(y)
             h_c = int(h)
             w_c = int(w)
             bb_ul = (x_c - w_c, y_c - h_c)
             bb_lr = (x_c + w_c, y_c + h_c)
-            self.detections = []
-            self.frame_num += 1
-            self.buoy_detection(timestamp(), bb_ul, bb_lr)
-
-        else:
-           self.detections = None
-           pass
+            return [self.buoy_detection(timestamp(), bb_ul, bb_lr)]
+        return []
 
-        
     def find_gate(self, image, depth):
         """Gate detection"""
+        self.frame_num += 1
+        self.detections = self._find_gate(image)
+        if not self.detections:
+            # nothing was found
+            print('null')
+            self.detections = None
+
+    def _find_gate(self, image):
+        """Gate detections of one image, both legs and the full gate"""
         """Gate leg class"""
         class GateLeg:
             def __init__(self):
@@ -294,146 +380,91 @@ class VisionNode:
             def print_leg(self):
                 print(str(self.x) + ', ' + str(self.y))
 
-        # smooth image with alternative closing/opening by adjusting kernel
-        morph = image.copy()
-        original = image.copy()
-        origin = image.copy()
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
-        morph = cv2.morphologyEx(morph, cv2.MORPH_CLOSE, kernel)
-        morph = cv2.morphologyEx(morph, cv2.MORPH_OPEN, kernel)
-
-        # take morphological gradient
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-        gradient_image = cv2.morphologyEx(morph, cv2.MORPH_GRADIENT, kernel)
-
-        # split the gradient image into channels
-        image_channels = np.split(np.asarray(gradient_image), 3, axis=2)
-        channel_height, channel_width, _ = image_channels[0].shape
-
-        # apply Otsu threshold to each channel
+        # statistics of every leg candidate, computed once per frame
+        close = self.gate_mask(image)
+        contours = cv2.findContours(close, cv2.RETR_EXTERNAL,
+                                    cv2.CHAIN_APPROX_SIMPLE)[-2]
+        rects = np.array([cv2.boundingRect(c) for c in contours],
+                         dtype=np.int64).reshape(-1, 4)
+        area = np.array([cv2.contourArea(c) for c in contours])
+        x, y, w, h = rects.T
+        fill = area / (w * h)
+
+        # pairs of legs that are far apart and at about the same height
+        is_pair = (np.abs(x[:, None] - x[None, :]) > self.leg_min_dx) \
+                & (np.abs(y[:, None] - y[None, :]) < self.leg_max_dy)
+        pair_area = area[:, None] + area[None, :]
+
+        # lower the required fill of the bounding box until a gate is found
+        for param in self.fill_levels:
+            is_leg = (fill > param) & (area > self.leg_min_area)
+            legs = np.flatnonzero(is_leg)
+            if legs.size < 2:
+                continue
+            if legs.size > 2:
+                # reflections and outliers are not part of a pair, the pair
+                # with the most area is the gate
+                is_valid = is_pair & is_leg[:, None] & is_leg[None, :]
+                if not np.any(is_valid):
+                    continue
+                score = np.where(is_valid, pair_area, -1)
+                legs = np.unravel_index(np.argmax(score), score.shape)
+
+            gate_legs = []
+            for i in legs:
+                leg = GateLeg()
+                leg.log(int(x[i]), int(y[i]), int(w[i]), int(h[i]))
+                gate_legs.append(leg)
+            return self.gate_detection(gate_legs)
+        return []
+
+    def gate_mask(self, image):
+        """Binary image of solid vertical leg lines. Work images are kept
+        for each image size and thread, and every step writes into them.
+        """
+        shape = image.shape[:2]
+        if not hasattr(self._gate_local, 'buffers'):
+            self._gate_local.buffers = {}
+        buffers = self._gate_local.buffers
+        if shape not in buffers:
+            buffers[shape] = dict(
+                gradient=np.empty(image.shape, np.uint8),
+                channel=np.empty(shape, np.uint8),
+                mask=np.empty(shape, np.uint8),
+                vertical=np.empty(shape, np.uint8),
+                close=np.empty(shape, np.uint8))
+        buf = buffers[shape]
+
+        # take morphological gradient, closing and opening with a 1x1 kernel
+        # do not change the image
+        cv2.morphologyEx(image, cv2.MORPH_GRADIENT, self.gradient_kernel,
+                         dst=buf['gradient'])
+
+        # Otsu threshold of each inverted channel. The channels are binary, so
+        # a (255, 255, 0) color is where blue and green are set and red is not
+        channel = buf['channel']
+        mask = buf['mask']
         for i in range(0, 3):
-            _, image_channels[i] = cv2.threshold(~image_channels[i], 0, 255, cv2.THRESH_OTSU | cv2.THRESH_BINARY)
-            image_channels[i] = np.reshape(image_channels[i], newshape=(channel_height, channel_width, 1))
-
-        # merge channels
-        image_channels = np.concatenate((image_channels[0], image_channels[1], image_channels[2]), axis=2)
-
-        # create result of low/high thresholds
-        low = np.array([120, 120, 0])
-        high = np.array([255, 255, 0])
-        mask = cv2.inRange(image_channels, low, high)
-        result = cv2.bitwise_and(image_channels, image_channels, mask=mask)
-
-        # isolate potential rectangles
-        gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
-        ret, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
+            cv2.extractChannel(buf['gradient'], i, dst=channel)
+            cv2.bitwise_not(channel, dst=channel)
+            cv2.threshold(channel, 0, 255, cv2.THRESH_OTSU | cv2.THRESH_BINARY,
+                          dst=channel)
+            if i == 0:
+                mask[:] = channel
+            elif i == 1:
+                cv2.bitwise_and(mask, channel, dst=mask)
+            else:
+                cv2.bitwise_not(channel, dst=channel)
+                cv2.bitwise_and(mask, channel, dst=mask)
 
         # find vertical leg lines
-        verticalStructure = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 10))
-        vertical = cv2.erode(thresh, verticalStructure)
-        vertical = cv2.dilate(vertical, verticalStructure)
-
-        # form solid leg lines and get contours
-        kernel = np.ones((45,45),np.uint8)
-        close = cv2.morphologyEx(vertical, cv2.MORPH_CLOSE, kernel)
-        im2, contours, hierarchy = cv2.findContours(close, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # initialize constants and variables
-        main = True
-        adjust = True
-        min_area = 20*20
-        param = 0.60
-        gate_legs = []
-        self.detections = []
-
-        while main:
-            # if parameter adjustment is needed
-            if (adjust == False):
-                param -= 0.10
-                if (param < 0):
-                    # nothing was found
-                    print('null')
-                    self.detections = None
-                    main = False
-
-                adjust = True
-
-            # draw contours with area bigger than a minimum and being rectangular
-            for contour in contours:
-                x = 0
-                y = 0
-                w = 0
-                h = 0
-                x, y, w, h = cv2.boundingRect(contour)
-                area = cv2.contourArea(contour)
-
-                # validate found area
-                if (area > (w * h * param) and area > min_area):
-                    # store potenial gate leg
-                    leg = GateLeg()
-                    leg.log(x, y, w, h)
-                    gate_legs.append(leg)
-
-            final_gate_legs = []
-            count = 0
-            fg_count = 0
-            # verify if there were more than two 'legs' found
-            if (len(gate_legs) > 2):
-                """find the outlier/reflection"""
-                x_temp = gate_legs[0].x
-                y_temp = gate_legs[0].y
-                count = 1
-                flag = True
-
-                while flag:
-                    # compare next potential leg to original
-                    if ((abs(x_temp - gate_legs[count].x) > 100) and (abs(y_temp - \
-                            gate_legs[count].y) < 50)):
-                        # a good match was found
-                        final_gate_legs.append(gate_legs[count])
-                        count += 1
-                        if (count > len(gate_legs)):
-                            # end of list was reached
-                            flag = False
-                        else:
-                            # add original to the final list, eliminating the outlier
-                            final_gate_legs.append(gate_legs[0])
-                            if ((count + 1) == len(gate_legs)):
-                                flag = False
-                            else:
-                                # keep finding reflections/outliers
-                                x_temp = final_gate_legs[fg_count].x
-                                y_temp = final_gate_legs[fg_count].y
-                                fg_count += 1
-                                count += 1
-                    else:
-                        # more than two were found, but too small
-                        flag = False
-
-                # if both legs were found
-                if (len(final_gate_legs) == 2):
-                    self.gate_detection(final_gate_legs)
-                    main = False
-
-                else:
-                    # adjust param at the beginning and start over
-                    adjust = False
-
-            # if two legs were originally found
-            if (len(gate_legs) == 2):
-                self.gate_detection(gate_legs)
-                main = False
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.leg_kernel,
+                         dst=buf['vertical'])
 
-            else:
-                # adjust parameter and start over
-                adjust = False
-
-        """analysis images
-        cv2.imshow("original", original)
-        cv2.imshow("line results", im)
-        cv2.imshow('result', result)
-        cv2.imshow('image', image_channels)
-        """
+        # form solid leg lines
+        cv2.morphologyEx(buf['vertical'], cv2.MORPH_CLOSE, self.close_kernel,
+                         dst=buf['close'])
+        return buf['close']
 
     def log(self, episode_name):
         """Save current detections to file"""
@@ -0,0 +1,56 @@
+"""
+Time vision detectors on a recorded episode. Every frame of the recording is
+passed to each detector, and the mean and worst latency per frame is reported,
+along with the peak memory allocated while processing a frame. The last row
+runs the enabled detectors of the node together on its thread pool.
+
+python bench_vision.py <recording folder>
+"""
+import sys
+import tracemalloc
+from time import perf_counter
+import numpy as np
+
+from zoidberg import ZedNode, VisionNode
+
+recording = sys.argv[1] if len(sys.argv) > 1 else '19_145_10_57_14'
+# detectors are called with the node, image and depth of each frame
+detectors = {'find_gate': lambda vn, image, depth: vn.find_gate(image, depth),
+             'find_buoy': lambda vn, image, depth: vn.find_buoy(image),
+             'find_rect': lambda vn, image, depth: vn.find_rect(image, depth),
+             # gate and buoy in parallel, the default enabled detectors
+             'gate+buoy': lambda vn, image, depth: vn.detect(image, depth)}
+
+# load every frame before timing, video decode is not counted
+zn = ZedNode(recording)
+zn.isactive(True)
+images = []
+depths = []
+while zn.check_readings():
+    images.append(zn.image)
+    depths.append(zn.depth)
+zn.isactive(False)
+print('{} frames of {}'.format(len(images), recording))
+
+vn = VisionNode()
+print('detector     mean ms    max ms   peak alloc kB   detections')
+for name, detect in detectors.items():
+    # first frame allocates reused buffers
+    detect(vn, images[0], depths[0])
+
+    times = []
+    peaks = []
+    num_found = 0
+    for image, depth in zip(images, depths):
+        tracemalloc.start()
+        start = perf_counter()
+        detect(vn, image, depth)
+        times.append(perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        num_found += vn.detections is not None and len(vn.detections) > 0
+    times = np.array(times) * 1e3
+    print('{:10s} {:9.2f} {:9.2f} {:15.0f} {:12d}'.format(
+          name, np.mean(times), np.max(times), np.max(peaks) / 1e3,
+          num_found))
+vn.close()